@@ -0,0 +1,82 @@
+import os
+import json
+import mimetypes
+
+from flask import has_request_context, request, send_from_directory, url_for
+
+MANIFEST_NAME = 'manifest.json'
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600  # Hashed files never change, so caches may keep them for a year
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+
+class AssetManifest:
+    """Maps static files to the hashed, optimized copies from scripts/build_assets.py.
+
+    Without a built manifest every lookup falls back to the plain file under
+    /static, so development works without running the build. URLs come from
+    url_for, so they keep the SCRIPT_NAME prefix when the app is mounted
+    below the site root; outside a request they start at static_url_path.
+    """
+
+    def __init__(self, static_folder, static_url_path):
+        self.static_folder = static_folder
+        self.static_url_path = static_url_path
+        self.dist_folder = os.path.join(static_folder, 'dist')
+        self.images = {}  # (script root, filename) -> image(), since url_for is called per variant
+        try:
+            with open(os.path.join(self.dist_folder, MANIFEST_NAME), 'r', encoding='utf-8') as f:
+                self.entries = json.load(f)
+            print(f"Loaded asset manifest with {len(self.entries)} entries.")
+        except FileNotFoundError:
+            print("No asset manifest found, serving unoptimized static files.")
+            self.entries = {}
+
+    def static_url(self, path):
+        """URL of `path` relative to static/, served by the dist route if it is built."""
+        if not has_request_context():
+            return f"{self.static_url_path}/{path}"
+        if path.startswith('dist/'):
+            return url_for('dist', filename=path[len('dist/'):])
+        return url_for('static', filename=path)
+
+    def url(self, filename):
+        """URL of the hashed copy of `filename` (relative to static/), if built."""
+        entry = self.entries.get(filename)
+        return self.static_url(entry['file'] if entry else filename)
+
+    def image(self, filename):
+        """Returns {'img': fallback URL, 'sources': [{'type', 'srcset'}, ...]} for `filename`.
+
+        Sources are ordered by preference (AVIF first), ready for a <picture> element.
+        The result is shared between requests and must not be modified.
+        """
+        key = (request.script_root if has_request_context() else None, filename)
+        image = self.images.get(key)
+        if image is None:
+            entry = self.entries.get(filename)
+            sources = []
+            for mime_type, variants in (entry or {}).get('variants', {}).items():
+                if variants:
+                    srcset = ', '.join(f"{self.static_url(path)} {width}w" for path, width in variants)
+                    sources.append({'type': mime_type, 'srcset': srcset})
+            image = self.images[key] = {'img': self.url(filename), 'sources': sources}
+        return image
+
+    def init_app(self, app):
+        app.add_template_global(self.url, 'asset_url')
+        app.add_url_rule(f"{self.static_url_path}/dist/<path:filename>", 'dist', self.send_dist_file)
+
+    def send_dist_file(self, filename):
+        """Serves a hashed file, precompressed when the client accepts it."""
+        mimetype = mimetypes.guess_type(filename)[0]
+        for encoding, suffix in ENCODINGS:
+            # Quality 0 (e.g. "br;q=0") means the client refuses the encoding
+            if request.accept_encodings[encoding] > 0 and os.path.isfile(os.path.join(self.dist_folder, filename + suffix)):
+                response = send_from_directory(self.dist_folder, filename + suffix, mimetype=mimetype, max_age=IMMUTABLE_MAX_AGE)
+                response.headers['Content-Encoding'] = encoding
+                break
+        else:
+            response = send_from_directory(self.dist_folder, filename, mimetype=mimetype, max_age=IMMUTABLE_MAX_AGE)
+        response.vary.add('Accept-Encoding')
+        response.cache_control.immutable = True
+        return response
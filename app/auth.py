@@ -0,0 +1,9 @@
+import secrets
+
+from flask import request
+
+
+def has_bearer_token(token):
+    """Whether the request carries `Authorization: Bearer <token>`; never with no token set."""
+    expected = f"Bearer {token}".encode('utf-8')
+    return bool(token) and secrets.compare_digest(request.headers.get('Authorization', '').encode('utf-8'), expected)
@@ -0,0 +1,201 @@
+"""Bulk readings, e.g. for daily-card pushes and pre-generated content.
+
+Items are JSON objects with an `id`, a `question`, an optional `locale`
+(default en) and an optional fixed `spread` of three [card index,
+"Upright"|"Reversed"] pairs; without a spread, cards are drawn at random.
+Results are JSON lines written as items finish, in completion order. A
+result has either `reading` or `error`.
+
+A job is resumed by passing the IDs that already have a reading, so only
+failed and missing items are generated again. From the command line:
+
+    python -m app.bulk items.ndjson results.ndjson
+
+appends to results.ndjson and skips the IDs already done in it.
+"""
+import sys
+import json
+import time
+import queue
+import argparse
+import threading
+import concurrent.futures
+
+from app import prompts, metrics
+from app.catalog import ORIENTATIONS
+
+POSITIONS = ('past', 'present', 'future')
+CONCURRENCY_PER_KEY = 4  # Readings in flight per API key
+
+
+class BulkItemError(ValueError):
+    pass
+
+
+def parse_item(raw, number_of_cards, languages):
+    """Validates one item; returns (id, question, locale, spread or None)."""
+    if not isinstance(raw, dict):
+        raise BulkItemError('Item must be an object.')
+    item_id = raw.get('id')
+    if not isinstance(item_id, (str, int)) or isinstance(item_id, bool):
+        raise BulkItemError('Item needs a string or integer `id`.')
+    question = raw.get('question')
+    if not isinstance(question, str) or not question.strip():
+        raise BulkItemError('Item needs a `question`.')
+    locale = raw.get('locale', 'en')
+    if locale not in languages:
+        raise BulkItemError(f"Unknown locale '{locale}'.")
+
+    spread = raw.get('spread')
+    if spread is not None:
+        if not isinstance(spread, list) or len(spread) != len(POSITIONS):
+            raise BulkItemError(f"`spread` must have {len(POSITIONS)} cards.")
+        for card in spread:
+            if (not isinstance(card, list) or len(card) != 2 or not isinstance(card[0], int) or isinstance(card[0], bool)
+                    or not 0 <= card[0] < number_of_cards or card[1] not in ORIENTATIONS):
+                raise BulkItemError('Spread cards must be [index, "Upright"|"Reversed"] pairs.')
+        if len({card[0] for card in spread}) != len(spread):
+            raise BulkItemError('Spread cards must be different.')
+    return item_id, question, locale, spread
+
+
+class BulkRunner:
+    """Generates readings for many items through the key scheduler.
+
+    At most CONCURRENCY_PER_KEY readings per API key are in flight, so
+    throughput grows with the number of keys. The scheduler spreads them
+    over the keys without hedging and honours each key's GEMINI_KEY_RPM.
+    """
+
+    def __init__(self, catalog, key_scheduler, languages, concurrency=None):
+        self.catalog = catalog
+        self.key_scheduler = key_scheduler
+        self.languages = languages
+        self.concurrency = concurrency or CONCURRENCY_PER_KEY * len(key_scheduler.keys)
+
+    def prepare(self, question, locale, spread):
+        """Returns (spread, cards for the response, prompt) for one item."""
+        if spread is None:
+            spread = self.catalog.draw(len(POSITIONS))
+        entries = [self.catalog.card(index, orientation, locale) for index, orientation in spread]
+        prompt, token_count = prompts.build_tarot_prompt(
+            question, entries, [], None, self.catalog.translations(locale), self.languages[locale])
+        metrics.PROMPT_TOKENS.observe(token_count, mode='bulk')
+        cards = {position: self.catalog.response(entry) for position, entry in zip(POSITIONS, entries)}
+        return spread, cards, prompt
+
+    def run(self, items, done_ids=()):
+        """Yields a result dict for every item not in `done_ids`, as each finishes."""
+        done_ids = {str(item_id) for item_id in done_ids}
+        finished = queue.Queue()
+        slots = threading.Semaphore(self.concurrency)
+        futures = set()
+        in_flight = 0
+
+        def on_done(future, result, start):
+            futures.discard(future)
+            try:
+                reading, _ = future.result()
+                result['reading'] = reading
+                metrics.RESPONSE_CHARS.observe(len(reading), mode='bulk')
+            except concurrent.futures.CancelledError:
+                result['error'] = 'Cancelled.'
+            except Exception as e:
+                result['error'] = str(e) or type(e).__name__
+            result['seconds'] = round(time.monotonic() - start, 3)
+            finished.put(result)
+            slots.release()
+
+        try:
+            for raw in items:
+                try:
+                    item_id, question, locale, spread = parse_item(raw, len(self.catalog.cards), self.languages)
+                except BulkItemError as e:
+                    yield {'id': raw.get('id') if isinstance(raw, dict) else None, 'error': str(e)}
+                    continue
+                if str(item_id) in done_ids:
+                    continue
+
+                # Blocks while the pool is full; whatever finished meanwhile goes out first
+                slots.acquire()
+                while not finished.empty():
+                    in_flight -= 1
+                    yield finished.get()
+
+                spread, cards, prompt = self.prepare(question, locale, spread)
+                result = {'id': item_id, 'locale': locale, 'question': question, 'spread': spread, 'cards': cards}
+                future = self.key_scheduler.submit(prompt)
+                futures.add(future)
+                in_flight += 1
+                future.add_done_callback(lambda future, result=result, start=time.monotonic(): on_done(future, result, start))
+
+            while in_flight:
+                in_flight -= 1
+                yield finished.get()
+        finally:
+            # The consumer went away, e.g. the client disconnected: stop calling Gemini
+            for future in list(futures):
+                future.cancel()
+
+
+def read_done_ids(path):
+    """IDs that already have a reading in an earlier, possibly cut off, output file."""
+    done = set()
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    result = json.loads(line)
+                except ValueError:
+                    continue  # Half-written last line of an interrupted run
+                if isinstance(result, dict) and result.get('reading'):
+                    done.add(str(result.get('id')))
+    except FileNotFoundError:
+        pass
+    return done
+
+
+def read_items(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        for number, line in enumerate(f, 1):
+            if line.strip():
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    print(f"Skipping line {number} of {path}: not valid JSON.")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Generate tarot readings in bulk.')
+    parser.add_argument('items', help='NDJSON file with one {"id", "question", "locale", "spread"} item per line')
+    parser.add_argument('output', help='NDJSON file results are appended to; IDs already done in it are skipped')
+    parser.add_argument('--concurrency', type=int, help=f"Readings in flight (default {CONCURRENCY_PER_KEY} per API key)")
+    args = parser.parse_args(argv)
+
+    from app.main import LANGUAGES, catalog, key_scheduler
+    if key_scheduler is None:
+        print("No GEMINI_API_KEY_n variables found in .env file.")
+        return 1
+    if not catalog.cards:
+        print("Tarot knowledge base is not loaded.")
+        return 1
+
+    done_ids = read_done_ids(args.output)
+    runner = BulkRunner(catalog, key_scheduler, LANGUAGES, args.concurrency)
+    print(f"Skipping {len(done_ids)} finished item(s); {runner.concurrency} reading(s) in flight at a time.")
+
+    start = time.monotonic()
+    counts = {'reading': 0, 'error': 0}
+    with open(args.output, 'a', encoding='utf-8') as output:
+        for result in runner.run(read_items(args.items), done_ids):
+            output.write(json.dumps(result, ensure_ascii=False) + "\n")
+            output.flush()
+            counts['reading' if 'reading' in result else 'error'] += 1
+    elapsed = time.monotonic() - start
+    print(f"Generated {counts['reading']} reading(s), {counts['error']} error(s) in {elapsed:.1f}s "
+          f"({counts['reading'] / elapsed if elapsed else 0:.2f} readings/s).")
+    return 1 if counts['error'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,161 @@
+import os
+import json
+import time
+import random
+import threading
+from collections import namedtuple
+
+BASE_DIR = os.path.dirname(__file__)
+TRANSLATIONS_DIR = os.path.join(BASE_DIR, '..', 'translations')
+KNOWLEDGE_PATH = os.path.join(BASE_DIR, 'tarot_knowledge.json')
+DEFAULT_LOCALE = 'en'
+ORIENTATIONS = ('Upright', 'Reversed')
+RELOAD_CHECK_INTERVAL = 1.0  # Seconds between mtime checks when hot reload is on
+
+# Everything about one card drawn in one orientation, already localized.
+# `image` is the card's file relative to static/; `response` is the dict sent
+# to the frontend for this card, minus the image URLs (see Catalog.response).
+CardEntry = namedtuple('CardEntry', ['name', 'image', 'orientation', 'meaning', 'response'])
+
+
+class FrozenDict(dict):
+    """A dict that can't be modified, so shared catalog data stays intact.
+
+    Subclassing dict keeps it usable with jsonify and the `tojson` filter.
+    """
+
+    def _readonly(self, *args, **kwargs):
+        raise TypeError('Catalog data is read-only.')
+
+    __setitem__ = __delitem__ = clear = pop = popitem = setdefault = update = _readonly
+
+
+def freeze(value):
+    if isinstance(value, dict):
+        return FrozenDict((key, freeze(item)) for key, item in value.items())
+    if isinstance(value, list):
+        return tuple(freeze(item) for item in value)
+    return value
+
+
+def load_json(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+class CatalogSnapshot:
+    """Translations and the card table, compiled once from the JSON files."""
+
+    def __init__(self, locales):
+        self.translations = {}
+        for locale in locales:
+            try:
+                self.translations[locale] = freeze(load_json(os.path.join(TRANSLATIONS_DIR, f"{locale}.json")))
+            except FileNotFoundError:
+                print(f"Translation file for '{locale}' not found, falling back to {DEFAULT_LOCALE}.")
+        if DEFAULT_LOCALE not in self.translations:
+            self.translations[DEFAULT_LOCALE] = freeze(load_json(os.path.join(TRANSLATIONS_DIR, f"{DEFAULT_LOCALE}.json")))
+        for locale in locales:
+            self.translations.setdefault(locale, self.translations[DEFAULT_LOCALE])
+
+        self.cards = self.load_cards()
+        self.entries = {}
+        for index, card in enumerate(self.cards):
+            image = f"images/{card['img']}"
+            for orientation in ORIENTATIONS:
+                meaning = card.get('meanings', {}).get(orientation.lower(), "No specific meaning found.")
+                for locale, translations in self.translations.items():
+                    name = translations['card_names'].get(card['name'], card['name'])
+                    label = translations.get(orientation.lower(), orientation)
+                    response = FrozenDict(name=name, orientation=label)
+                    self.entries[index, orientation, locale] = CardEntry(name, image, label, meaning, response)
+
+    @staticmethod
+    def load_cards():
+        """Loads the tarot card knowledge base from the JSON file."""
+        try:
+            tarot_data = load_json(KNOWLEDGE_PATH)
+            print("Successfully loaded tarot knowledge base.")
+            return freeze(tarot_data)
+        except FileNotFoundError:
+            print(f"CRITICAL ERROR: tarot_knowledge.json not found at {KNOWLEDGE_PATH}")
+        except json.JSONDecodeError:
+            print(f"CRITICAL ERROR: Could not decode tarot_knowledge.json.")
+        return ()
+
+
+class Catalog:
+    """Locale and card data served from memory on the request path.
+
+    The JSON files are read once at startup. With `reload=True` their mtimes
+    are checked at most once a second and a changed file triggers a rebuild,
+    which is swapped in as a whole so requests never see a half-built table.
+    """
+
+    def __init__(self, locales, assets, reload=False):
+        self.locales = list(locales)
+        self.assets = assets
+        self.reload = reload
+        self.reload_lock = threading.Lock()
+        self.next_check = 0.0
+        self.mtimes = self.read_mtimes()
+        self.snapshot = CatalogSnapshot(self.locales)
+
+    def read_mtimes(self):
+        paths = [KNOWLEDGE_PATH] + [os.path.join(TRANSLATIONS_DIR, f"{locale}.json") for locale in self.locales]
+        mtimes = {}
+        for path in paths:
+            try:
+                mtimes[path] = os.stat(path).st_mtime
+            except FileNotFoundError:
+                mtimes[path] = None
+        return mtimes
+
+    def maybe_reload(self):
+        if not self.reload or time.monotonic() < self.next_check:
+            return
+        with self.reload_lock:
+            if time.monotonic() < self.next_check:
+                return
+            self.next_check = time.monotonic() + RELOAD_CHECK_INTERVAL
+            mtimes = self.read_mtimes()
+            if mtimes != self.mtimes:
+                print("Catalog files changed, reloading translations and tarot knowledge base.")
+                try:
+                    self.snapshot = CatalogSnapshot(self.locales)
+                except (OSError, ValueError) as e:
+                    # Keep serving the last good snapshot, e.g. while a file is half-saved
+                    print(f"Could not reload catalog: {e}")
+                    return
+                self.mtimes = mtimes
+
+    @property
+    def cards(self):
+        return self.snapshot.cards
+
+    def draw(self, count=3):
+        """Draws `count` different cards, each upright or reversed at random.
+
+        Returns [index, orientation] pairs, the form kept in the session.
+        """
+        indexes = random.sample(range(len(self.snapshot.cards)), count)
+        return [[index, random.choice(ORIENTATIONS)] for index in indexes]
+
+    def translations(self, locale):
+        snapshot = self.snapshot
+        return snapshot.translations.get(locale, snapshot.translations[DEFAULT_LOCALE])
+
+    def card(self, index, orientation, locale):
+        """Looks up a card by its position in the knowledge base."""
+        snapshot = self.snapshot
+        entry = snapshot.entries.get((index, orientation, locale))
+        if entry is None:
+            entry = snapshot.entries[index, orientation, DEFAULT_LOCALE]
+        return entry
+
+    def response(self, entry):
+        """The frontend's dict for a card: name, orientation, `img` and optimized `sources`.
+
+        Image URLs are resolved per request so they follow the app's SCRIPT_NAME.
+        """
+        return dict(entry.response, **self.assets.image(entry.image))
@@ -0,0 +1,34 @@
+import os
+import sqlite3
+import threading
+
+
+class Database:
+    """A SQLite database in WAL mode, shared by all gunicorn workers.
+
+    The `schema` statements run on a throwaway connection so none is inherited
+    across fork(); after that every thread of every process gets its own
+    connection from `db`, since sqlite3 connections can't be shared.
+    """
+
+    def __init__(self, path, schema=()):
+        self.path = path
+        self.local = threading.local()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        db = self.connect()
+        for statement in schema:
+            db.execute(statement)
+        db.close()
+
+    def connect(self):
+        db = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+        db.execute('PRAGMA journal_mode=WAL')
+        db.execute('PRAGMA synchronous=NORMAL')
+        return db
+
+    @property
+    def db(self):
+        if getattr(self.local, 'pid', None) != os.getpid():
+            self.local.db = self.connect()
+            self.local.pid = os.getpid()
+        return self.local.db
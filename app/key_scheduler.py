@@ -0,0 +1,514 @@
+import os
+import time
+import sqlite3
+import hashlib
+import queue
+import asyncio
+import threading
+from collections import deque
+
+import grpc
+import google.generativeai as genai
+from google.ai import generativelanguage as glm
+from google.ai.generativelanguage_v1beta.services.generative_service.transports import GenerativeServiceGrpcAsyncIOTransport
+from google.api_core import exceptions as api_exceptions
+
+from app import metrics
+from app.database import Database
+
+MODEL_NAME = 'gemini-1.5-flash'
+# Plaintext host:port of a local stand-in such as bench/fake_gemini.py
+API_ENDPOINT = os.getenv('GEMINI_API_ENDPOINT')
+
+# --- Scheduler Configuration ---
+REQUEST_TIMEOUT = float(os.getenv('GEMINI_TIMEOUT', '15'))  # Also the longest wait for the next streamed chunk
+STREAM_TIMEOUT = float(os.getenv('GEMINI_STREAM_TIMEOUT', '60'))  # For a whole streamed reading
+DEFAULT_HEDGE_DELAY = float(os.getenv('GEMINI_HEDGE_DELAY', '4'))
+MAX_IN_FLIGHT = int(os.getenv('GEMINI_MAX_IN_FLIGHT', '256'))  # Per gunicorn worker
+KEY_RPM = float(os.getenv('GEMINI_KEY_RPM', '0'))  # Requests per minute allowed per key, 0 for no limit
+MIN_LATENCY_SAMPLES = 5  # Below this we don't trust the observed p90 yet
+EWMA_ALPHA = 0.2
+FAILURE_THRESHOLD = 3  # Consecutive 5xx/timeouts before a key is put on cooldown
+BASE_COOLDOWN = 5.0
+MAX_COOLDOWN = 120.0
+
+# Errors caused by the prompt rather than the key, e.g. a reading blocked by
+# the safety filters (`.text` raises ValueError). Another key would fail the
+# same way, so these are neither retried nor held against the key. A 400 is
+# not among them: Gemini answers a revoked or mistyped key with one.
+REQUEST_ERRORS = (ValueError, genai.types.BlockedPromptException, genai.types.StopCandidateException)
+
+_STREAM_END = object()
+
+
+class NoAvailableKeyError(Exception):
+    pass
+
+
+def is_key_error(error):
+    """Whether `error` says the API key itself is invalid, expired or not allowed."""
+    if isinstance(error, (api_exceptions.PermissionDenied, api_exceptions.Unauthenticated)):
+        return True
+    if isinstance(error, api_exceptions.BadRequest):
+        return error.reason == 'API_KEY_INVALID' or 'API key' in str(error)
+    return False
+
+
+def make_model(api_key):
+    """Creates a GenerativeModel bound to its own async client for one API key.
+
+    genai.configure() sets process-global state, so instead of configuring the
+    library per call we give each model a dedicated client up front. Must be
+    called on the scheduler's event loop, which the gRPC channel binds to.
+    """
+    model = genai.GenerativeModel(MODEL_NAME)
+    if API_ENDPOINT:
+        channel = grpc.aio.insecure_channel(API_ENDPOINT, interceptors=[ApiKeyInterceptor(api_key)])
+        transport = GenerativeServiceGrpcAsyncIOTransport(channel=channel)
+        model._async_client = glm.GenerativeServiceAsyncClient(transport=transport)
+    else:
+        model._async_client = glm.GenerativeServiceAsyncClient(client_options={'api_key': api_key})
+    return model
+
+
+class TokenBucket:
+    """Allows `rate` calls per second on average, in bursts of up to `burst`.
+
+    Callers reserve a token up front and may go into debt, which makes them
+    queue in order. A rate of 0 means no limit. Only used from the scheduler
+    loop, so no locks.
+    """
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def wait_time(self):
+        """Seconds until a token is available."""
+        if not self.rate:
+            return 0.0
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        return max(0.0, (1 - self.tokens) / self.rate)
+
+    def reserve(self):
+        """Takes a token; returns the seconds to wait before using it."""
+        if not self.rate:
+            return 0.0
+        delay = self.wait_time()
+        self.tokens -= 1
+        return delay
+
+    def refund(self):
+        if self.rate:
+            self.tokens += 1
+
+
+class SharedTokenBucket(TokenBucket):
+    """A TokenBucket kept in SQLite, so all workers and the bulk CLI share one per key.
+
+    The row is keyed by a hash of the API key and uses wall-clock time, the
+    only clock processes agree on. If the database fails the call goes ahead
+    unthrottled rather than failing the reading.
+    """
+
+    def __init__(self, database, api_key, rate, burst):
+        super().__init__(rate, burst)
+        self.database = database
+        self.key_id = hashlib.sha256(api_key.encode('utf-8')).hexdigest()[:16]
+
+    def load(self, db, now):
+        row = db.execute('SELECT tokens, updated FROM buckets WHERE key = ?', (self.key_id,)).fetchone()
+        tokens, updated = row if row else (self.burst, now)
+        return min(self.burst, tokens + max(now - updated, 0) * self.rate)
+
+    def wait_time(self):
+        if not self.rate:
+            return 0.0
+        try:
+            tokens = self.load(self.database.db, time.time())
+        except sqlite3.Error as e:
+            print(f"Could not read rate limit: {e}")
+            return 0.0
+        return max(0.0, (1 - tokens) / self.rate)
+
+    def reserve(self):
+        if not self.rate:
+            return 0.0
+        db = self.database.db
+        try:
+            db.execute('BEGIN IMMEDIATE')
+            try:
+                now = time.time()
+                tokens = self.load(db, now)
+                db.execute('INSERT OR REPLACE INTO buckets (key, tokens, updated) VALUES (?, ?, ?)', (self.key_id, tokens - 1, now))
+                db.execute('COMMIT')
+            except BaseException:
+                db.execute('ROLLBACK')
+                raise
+        except sqlite3.Error as e:
+            print(f"Could not reserve rate limit token: {e}")
+            return 0.0
+        return max(0.0, (1 - tokens) / self.rate)
+
+    def refund(self):
+        if not self.rate:
+            return
+        try:
+            self.database.db.execute('UPDATE buckets SET tokens = tokens + 1 WHERE key = ?', (self.key_id,))
+        except sqlite3.Error as e:
+            print(f"Could not refund rate limit token: {e}")
+
+
+class ApiKeyInterceptor(grpc.aio.UnaryUnaryClientInterceptor, grpc.aio.UnaryStreamClientInterceptor):
+    """Sends the API key as metadata on channels that carry no credentials."""
+
+    def __init__(self, api_key):
+        self.api_key = api_key
+
+    def with_key(self, call_details):
+        metadata = grpc.aio.Metadata(*(call_details.metadata or ()))
+        metadata.add('x-goog-api-key', self.api_key)
+        return call_details._replace(metadata=metadata)
+
+    async def intercept_unary_unary(self, continuation, call_details, request):
+        return await continuation(self.with_key(call_details), request)
+
+    async def intercept_unary_stream(self, continuation, call_details, request):
+        return await continuation(self.with_key(call_details), request)
+
+
+class KeyState:
+    """Latency and health bookkeeping for a single API key."""
+
+    def __init__(self, api_key, rpm=KEY_RPM, database=None):
+        self.api_key = api_key
+        if database is not None:
+            self.bucket = SharedTokenBucket(database, api_key, rpm / 60, max(1.0, rpm / 60))
+        else:
+            self.bucket = TokenBucket(rpm / 60, max(1.0, rpm / 60))
+        self.model = None
+        self.latency_ewma = None
+        self.latencies = deque(maxlen=50)
+        self.in_flight = 0
+        self.consecutive_failures = 0
+        self.cooldown_until = 0.0
+
+    @property
+    def label(self):
+        return f"...{self.api_key[-4:]}"
+
+    def is_available(self, now):
+        return now >= self.cooldown_until
+
+    def call_finished(self, task):
+        self.in_flight -= 1
+
+    def hedge_delay(self):
+        """Returns the observed p90 latency, used as the point to fire a hedge."""
+        if len(self.latencies) < MIN_LATENCY_SAMPLES:
+            return DEFAULT_HEDGE_DELAY
+        ordered = sorted(self.latencies)
+        return ordered[int(0.9 * (len(ordered) - 1))]
+
+    def record_success(self, latency):
+        metrics.GEMINI_SECONDS.observe(latency, key=self.label)
+        metrics.GEMINI_CALLS.inc(key=self.label, outcome='success')
+        self.latencies.append(latency)
+        if self.latency_ewma is None:
+            self.latency_ewma = latency
+        else:
+            self.latency_ewma = EWMA_ALPHA * latency + (1 - EWMA_ALPHA) * self.latency_ewma
+        self.consecutive_failures = 0
+
+    def record_failure(self, error):
+        self.consecutive_failures += 1
+        cooldown = min(BASE_COOLDOWN * 2 ** (self.consecutive_failures - 1), MAX_COOLDOWN)
+        if isinstance(error, api_exceptions.TooManyRequests):
+            # Quota is exhausted, there is no point in retrying this key right away
+            metrics.GEMINI_CALLS.inc(key=self.label, outcome='rate_limited')
+            tripped = True
+        elif is_key_error(error):
+            # A bad key won't fix itself, so only check back after the longest cooldown
+            metrics.GEMINI_CALLS.inc(key=self.label, outcome='invalid_key')
+            tripped, cooldown = True, MAX_COOLDOWN
+        else:
+            timed_out = isinstance(error, (asyncio.TimeoutError, api_exceptions.DeadlineExceeded))
+            metrics.GEMINI_CALLS.inc(key=self.label, outcome='timeout' if timed_out else 'error')
+            tripped = self.consecutive_failures >= FAILURE_THRESHOLD
+        if tripped:
+            self.cooldown_until = time.monotonic() + cooldown
+            print(f"API key ending in {self.label} cooling down for {cooldown:.0f}s after: {error}")
+
+class KeyScheduler:
+    """Sends Gemini requests from one background asyncio event loop per process.
+
+    Request threads hand their prompt to the loop and block on the result, so
+    every in-flight reading in a worker shares a single I/O thread instead of
+    owning one. Requests go to the healthiest, fastest key first. A hedged
+    request is sent to the next key only when the first one is slower than its
+    observed p90; whichever answers first wins and the other is cancelled.
+
+    All KeyState bookkeeping happens on the loop thread, so it needs no locks.
+    With `rate_limit_path`, the per-key rate limits live in that SQLite
+    database and are shared with every other process using it.
+    """
+
+    def __init__(self, api_keys, max_in_flight=MAX_IN_FLIGHT, timeout=REQUEST_TIMEOUT, rpm=KEY_RPM, stream_timeout=STREAM_TIMEOUT,
+                 rate_limit_path=None):
+        database = None
+        if rpm and rate_limit_path:
+            database = Database(rate_limit_path, (
+                'CREATE TABLE IF NOT EXISTS buckets (key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL)',
+            ))
+        self.keys = [KeyState(key, rpm, database) for key in api_keys]
+        self.max_in_flight = max_in_flight
+        self.timeout = timeout
+        self.stream_timeout = stream_timeout
+        self.slots = None
+        self.loop = None
+        self.loop_pid = None
+        self.loop_lock = threading.Lock()
+
+    def get_loop(self):
+        """Starts the event loop thread on first use.
+
+        Threads don't survive fork(), so a gunicorn worker started from a
+        preloaded app gets its own loop the first time it needs one.
+        """
+        with self.loop_lock:
+            if self.loop is None or self.loop_pid != os.getpid():
+                loop = asyncio.new_event_loop()
+                threading.Thread(target=loop.run_forever, name='gemini-loop', daemon=True).start()
+                asyncio.run_coroutine_threadsafe(self.setup(), loop).result()
+                self.loop, self.loop_pid = loop, os.getpid()
+            return self.loop
+
+    async def setup(self):
+        self.slots = asyncio.Semaphore(self.max_in_flight)
+        for state in self.keys:
+            state.model = make_model(state.api_key)
+
+    def ranked_keys(self, balanced=False):
+        """Returns keys ordered by preference; keys on cooldown are only a last resort.
+
+        Keys without rate limit tokens come next. Normally the fastest key is
+        preferred; `balanced` prefers the least busy one, spreading load over
+        all keys. A key that hasn't answered yet counts as taking
+        DEFAULT_HEDGE_DELAY, so it is tried but doesn't outrank measured keys.
+        """
+        now = time.monotonic()
+        def score(state):
+            latency = state.latency_ewma if state.latency_ewma is not None else DEFAULT_HEDGE_DELAY
+            if balanced:
+                return (not state.is_available(now), state.bucket.wait_time(), state.in_flight, latency)
+            return (not state.is_available(now), state.bucket.wait_time() > 0, latency, state.in_flight)
+        return sorted(self.keys, key=score)
+
+    # --- Blocking entry points for request threads ---
+
+    def generate(self, prompt, timings=None):
+        """Returns (text, api_key) for the first successful response.
+
+        If a `timings` dict is given, `timings['queue']` is set to the seconds
+        spent waiting for the loop and a free slot before the first call.
+        """
+        if timings is not None:
+            timings['submitted'] = time.monotonic()
+        future = asyncio.run_coroutine_threadsafe(self.generate_async(prompt, timings), self.get_loop())
+        return future.result()
+
+    def submit(self, prompt):
+        """Starts a balanced, unhedged generation for a bulk job.
+
+        Returns a concurrent.futures.Future resolving to (text, api_key).
+        """
+        return asyncio.run_coroutine_threadsafe(self.generate_async(prompt, balanced=True), self.get_loop())
+
+    def stream(self, prompt, timings=None):
+        """Yields response chunks on the calling thread as the loop receives them."""
+        chunks = queue.Queue()
+        if timings is not None:
+            timings['submitted'] = time.monotonic()
+
+        async def pump():
+            try:
+                async for chunk in self.stream_async(prompt, timings):
+                    chunks.put(chunk)
+                chunks.put(_STREAM_END)
+            except Exception as e:
+                chunks.put(e)
+
+        future = asyncio.run_coroutine_threadsafe(pump(), self.get_loop())
+        try:
+            while True:
+                try:
+                    # stream_async enforces the timeouts; this only guards against a stuck loop
+                    item = chunks.get(timeout=self.stream_timeout + self.timeout)
+                except queue.Empty:
+                    raise TimeoutError('Gemini stream stalled.')
+                if item is _STREAM_END:
+                    return
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            # Stops the Gemini stream if the client went away mid-reading
+            future.cancel()
+
+    # --- Coroutines running on the scheduler loop ---
+
+    async def wait_for_token(self, state, delay):
+        try:
+            await asyncio.sleep(delay)
+        except asyncio.CancelledError:
+            state.bucket.refund()
+            raise
+
+    async def call(self, state, prompt, timings=None, token_delay=0.0, started=None):
+        """Calls Gemini with `state`'s key; adds the task to `started` once the request is sent."""
+        if token_delay:
+            await self.wait_for_token(state, token_delay)
+        async with self.slots:
+            if timings is not None and 'queue' not in timings:
+                timings['queue'] = time.monotonic() - timings['submitted']
+            start = time.monotonic()
+            if started is not None:
+                started.add(asyncio.current_task())
+            try:
+                response = await state.model.generate_content_async(prompt)
+                text = response.text
+            except asyncio.CancelledError:
+                raise  # Lost the hedge race or timed out, see generate_async
+            except REQUEST_ERRORS:
+                metrics.GEMINI_CALLS.inc(key=state.label, outcome='request_error')
+                raise
+            except Exception as e:
+                state.record_failure(e)
+                raise
+        state.record_success(time.monotonic() - start)
+        return text
+
+    async def generate_async(self, prompt, timings=None, balanced=False):
+        """Returns (text, api_key), hedging slow calls unless `balanced`.
+
+        Balanced calls, used for bulk jobs, only move on to another key when
+        a call fails, so no quota is spent on duplicate requests.
+        """
+        candidates = self.ranked_keys(balanced)
+        if not candidates:
+            raise NoAvailableKeyError('No API keys configured.')
+
+        loop = asyncio.get_running_loop()
+        pending = {}
+        started = set()  # Tasks that got past the rate limit and a slot and sent their request
+        hedged = False
+        last_error = None
+
+        def launch():
+            # Reserve the token and count the call right away, so requests
+            # launched in the same loop iteration already see each other
+            state = candidates.pop(0)
+            token_delay = state.bucket.reserve()
+            task = asyncio.ensure_future(self.call(state, prompt, timings, token_delay, started))
+            state.in_flight += 1
+            task.add_done_callback(state.call_finished)
+            pending[task] = state
+            return loop.time() + token_delay, state
+
+        start_at, state = launch()
+        deadline = start_at + self.timeout  # Waiting for a rate limit token doesn't count
+        hedge_at = start_at + state.hedge_delay()
+        try:
+            while pending:
+                now = loop.time()
+                if now >= deadline:
+                    break
+                wait_until = deadline
+                if candidates and not hedged and not balanced:
+                    wait_until = min(wait_until, hedge_at)
+                done, _ = await asyncio.wait(pending, timeout=max(wait_until - now, 0), return_when=asyncio.FIRST_COMPLETED)
+
+                for task in done:
+                    state = pending.pop(task)
+                    try:
+                        return task.result(), state.api_key
+                    except REQUEST_ERRORS:
+                        raise
+                    except Exception as e:
+                        last_error = e
+                        print(f"Error with API key ending in {state.label}: {e}")
+
+                if candidates and (not pending or (not hedged and not balanced and loop.time() >= hedge_at)):
+                    # Either every in-flight request failed or the slow one crossed its p90
+                    if pending:
+                        hedged = True
+                    start_at, state = launch()
+                    hedge_at = start_at + state.hedge_delay()
+        finally:
+            # Still pending here means the request timed out, or these lost the hedge race.
+            # Calls still waiting for a token or a slot never reached Gemini, so
+            # they don't count against their key.
+            timed_out = loop.time() >= deadline
+            for task, state in pending.items():
+                if timed_out and task in started:
+                    state.record_failure(asyncio.TimeoutError(f"No response within {self.timeout:g}s"))
+                else:
+                    metrics.GEMINI_CALLS.inc(key=state.label, outcome='cancelled')
+                task.cancel()
+
+        if last_error is not None and not pending:
+            raise last_error
+        raise TimeoutError('All API keys failed or timed out.')
+
+    async def stream_async(self, prompt, timings=None):
+        """Yields response chunks from the first key that starts streaming.
+
+        Every chunk must arrive within `timeout` seconds and the whole reading
+        within `stream_timeout`. Only failures before the first chunk fail
+        over to another key; after that the caller already has partial text.
+        """
+        loop = asyncio.get_running_loop()
+        last_error = None
+        for state in self.ranked_keys():
+            await self.wait_for_token(state, state.bucket.reserve())
+            async with self.slots:
+                if timings is not None and 'queue' not in timings:
+                    timings['queue'] = time.monotonic() - timings['submitted']
+                start = time.monotonic()
+                deadline = loop.time() + self.stream_timeout
+                try:
+                    response = await asyncio.wait_for(state.model.generate_content_async(prompt, stream=True), self.timeout)
+                    chunks = response.__aiter__()
+                    first_chunk = await asyncio.wait_for(chunks.__anext__(), self.timeout)
+                except asyncio.CancelledError:
+                    raise
+                except REQUEST_ERRORS:
+                    metrics.GEMINI_CALLS.inc(key=state.label, outcome='request_error')
+                    raise
+                except Exception as e:
+                    state.record_failure(e)
+                    last_error = e
+                    print(f"Error with API key ending in {state.label}: {e}")
+                    continue
+
+                state.consecutive_failures = 0
+                print(f"Streaming response from key ending in {state.label}")
+                yield first_chunk
+                while True:
+                    try:
+                        chunk = await asyncio.wait_for(chunks.__anext__(), min(self.timeout, max(deadline - loop.time(), 0)))
+                    except StopAsyncIteration:
+                        break
+                    except asyncio.TimeoutError:
+                        state.record_failure(asyncio.TimeoutError('Gemini stream stalled.'))
+                        raise
+                    yield chunk
+                metrics.GEMINI_SECONDS.observe(time.monotonic() - start, key=state.label)
+                metrics.GEMINI_CALLS.inc(key=state.label, outcome='success')
+                return
+
+        raise last_error or NoAvailableKeyError('No API keys configured.')
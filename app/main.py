@@ -1,12 +1,17 @@
 import os
-import random
+import time
 import json
-from flask import Flask, render_template, request, jsonify, url_for, session, g
+from flask import Flask, Response, render_template, request, jsonify, session, g, stream_with_context
 from flask_babel import Babel, gettext
 from dotenv import load_dotenv
-import google.generativeai as genai
-import threading
-import queue
+from app.assets import AssetManifest
+from app.catalog import Catalog
+from app.key_scheduler import KeyScheduler
+from app import prompts, metrics
+from app.auth import has_bearer_token
+from app.session_store import ServerSideSessionInterface, SqliteSessionStore
+from app.reading_cache import ReadingCache, make_key
+from app.bulk import BulkRunner
 
 # Load environment variables from .env file
 load_dotenv()
@@ -30,44 +35,48 @@ def get_locale():
     # header the browser transmits.
     return request.accept_languages.best_match(list(LANGUAGES.keys()))
 
-def load_translations(lang):
-    translation_path = os.path.join(os.path.dirname(__file__), '..', 'translations', f"{lang}.json")
-    try:
-        with open(translation_path, 'r', encoding='utf-8') as f:
-            return json.load(f)
-    except FileNotFoundError:
-        # Fallback to English if a translation is missing
-        fallback_path = os.path.join(os.path.dirname(__file__), '..', 'translations', 'en.json')
-        with open(fallback_path, 'r', encoding='utf-8') as f:
-            return json.load(f)
-
 @app.before_request
 def before_request():
-    g.locale = str(get_locale())
-    g.translations = load_translations(g.locale)
-
-app.secret_key = os.urandom(24) # Needed for session management
+    with metrics.phase('locale'):
+        g.locale = str(get_locale())
+        catalog.maybe_reload()
+        g.translations = catalog.translations(g.locale)
+
+app.secret_key = os.getenv('FLASK_SECRET_KEY') or os.urandom(24) # Needed for session management
+
+# Conversations are stored server-side so every gunicorn worker sees the same
+# sessions and the cookie only carries a session ID.
+session_db_path = os.getenv('SESSION_DB_PATH', os.path.join(app.instance_path, 'sessions.sqlite3'))
+session_ttl = int(os.getenv('SESSION_TTL', 24 * 60 * 60))
+app.session_interface = ServerSideSessionInterface(SqliteSessionStore(session_db_path), session_ttl)
+
+# Opt-in cache of first readings, keyed by locale, spread and question. Set
+# READING_CACHE=1 to turn it on; it is shared by all workers through SQLite.
+reading_cache = None
+if os.getenv('READING_CACHE') == '1':
+    reading_cache = ReadingCache(
+        os.getenv('READING_CACHE_PATH', os.path.join(app.instance_path, 'reading_cache.sqlite3')),
+        ttl=int(os.getenv('READING_CACHE_TTL', 7 * 24 * 60 * 60)),
+        max_entries=int(os.getenv('READING_CACHE_SIZE', 10000)))
+
+# Hashed, precompressed assets from scripts/build_assets.py, when built
+assets = AssetManifest(app.static_folder, app.static_url_path)
+assets.init_app(app)
+
+# Per-phase timings, Gemini outcomes and sizes, shared by all workers through
+# SQLite and served at /metrics to holders of METRICS_TOKEN. SERVER_TIMING=1
+# adds a Server-Timing header.
+metrics.init_app(app, os.getenv('METRICS_DB_PATH', os.path.join(app.instance_path, 'metrics.sqlite3')),
+                 token=os.getenv('METRICS_TOKEN'), server_timing_header=os.getenv('SERVER_TIMING') == '1')
+
+# Bulk readings for content jobs (see app/bulk.py). The HTTP endpoint is
+# only enabled when BULK_API_TOKEN is set, since every item costs quota.
+bulk_api_token = os.getenv('BULK_API_TOKEN')
 
 # --- Tarot Card Data ---
-def load_tarot_knowledge():
-    """Loads the tarot card knowledge base from the JSON file."""
-    knowledge_path = os.path.join(os.path.dirname(__file__), 'tarot_knowledge.json')
-    try:
-        with open(knowledge_path, 'r', encoding='utf-8') as f:
-            tarot_data = json.load(f)
-            # Create a dictionary for easy lookup by card name
-            tarot_knowledge_base = {card['name']: card for card in tarot_data}
-            print("Successfully loaded tarot knowledge base.")
-            return tarot_data, tarot_knowledge_base
-    except FileNotFoundError:
-        print(f"CRITICAL ERROR: tarot_knowledge.json not found at {knowledge_path}")
-        return [], {} # Return empty structures if file is not found
-    except json.JSONDecodeError:
-        print(f"CRITICAL ERROR: Could not decode tarot_knowledge.json.")
-        return [], {}
-
-# Load the knowledge base when the app starts
-TAROT_CARDS, TAROT_KNOWLEDGE_BASE = load_tarot_knowledge()
+# Translations and the tarot knowledge base are compiled once at startup.
+# Set CATALOG_HOT_RELOAD=1 to pick up edits to the JSON files without a restart.
+catalog = Catalog(LANGUAGES, assets, reload=os.getenv('CATALOG_HOT_RELOAD') == '1')
 
 
 # --- Gemini API Configuration ---
@@ -75,30 +84,52 @@ api_keys = [os.getenv(key) for key in os.environ if key.startswith("GEMINI_API_K
 api_keys = [key for key in api_keys if key]  # Filter out empty/None keys
 
 api_configured = False
+key_scheduler = None
 if not api_keys:
     print("No GEMINI_API_KEY_n variables found in .env file.")
 else:
     print(f"Found {len(api_keys)} API key(s).")
     api_configured = True
+    # With GEMINI_KEY_RPM, every worker and the bulk CLI share each key's limit through SQLite
+    key_scheduler = KeyScheduler(api_keys, rate_limit_path=os.getenv(
+        'RATE_LIMIT_DB_PATH', os.path.join(app.instance_path, 'rate_limits.sqlite3')))
+
+def get_gemini_stream(prompt):
+    """Yields reading text chunks as Gemini generates them."""
+    if not api_configured:
+        raise RuntimeError('API not configured. Check .env file.')
 
-def get_gemini_response(api_key, prompt, result_queue):
-    """Configures Gemini and gets a response, putting it in the queue."""
+    timings = {}
+    start = time.perf_counter()
     try:
-        # Each thread needs its own configured instance of the API
-        genai.configure(api_key=api_key)
-        model = genai.GenerativeModel('gemini-1.5-flash')
-        response = model.generate_content(prompt)
-        # We only care about the first successful response
-        if result_queue.empty():
-            result_queue.put({'text': response.text, 'key_used': api_key})
+        for chunk in key_scheduler.stream(prompt, timings):
+            yield from get_chunk_text(chunk)
+        metrics.record_phase('gemini', time.perf_counter() - start)
     except Exception as e:
-        # Log errors for debugging but don't stop other threads
-        print(f"Error with API key ending in ...{api_key[-4:]}: {e}")
+        print(f"Streaming from Gemini failed: {e}")
+        raise RuntimeError('Could not get a response from the tarot spirits. Please try again.')
+    finally:
+        if 'queue' in timings:
+            metrics.record_phase('queue', timings['queue'])
+
+def get_chunk_text(chunk):
+    # Chunks without text parts (e.g. a bare finish_reason) raise on .text
+    try:
+        text = chunk.text
+    except ValueError:
+        return
+    if text:
+        yield text
+
+def sse_event(event, data):
+    """Formats a single Server-Sent Event with a JSON payload."""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
 
 @app.route('/')
 def index():
     session['language'] = g.locale
-    return render_template('index.html', languages=LANGUAGES, translations=g.translations)
+    images = {'cardBack': assets.image('images/card_back.jpg'), 'mascot': assets.image('images/wizard-cat.png')}
+    return render_template('index.html', languages=LANGUAGES, translations=g.translations, images=images)
 
 @app.route('/set_language/<lang>')
 def set_language(lang):
@@ -115,41 +146,25 @@ def chat():
     if not question:
         return jsonify({'error': 'Question is required.'}), 400
     
-    if not TAROT_CARDS:
+    if not catalog.cards:
          return jsonify({'error': 'Tarot knowledge base is not loaded. Check server logs.'}), 500
 
-    # --- Conversation History ---
-    if 'history' not in session:
-        session['history'] = []
-
-    history_string = ""
-    for entry in session['history']:
-        history_string += f"Previous Question: {entry['question']}\nPrevious Reading: {entry['reading']}\n\n"
-
     if mode == 'tarot':
         # --- TAROT MODE: Draw new cards and perform a full reading ---
-        drawn_cards_info = []
-        sampled_cards = random.sample(TAROT_CARDS, 3)
-        for card in sampled_cards:
-            orientation = random.choice(['Upright', 'Reversed'])
-            drawn_cards_info.append({**card, 'orientation': orientation})
-
-        session['last_cards'] = drawn_cards_info  # Save cards to session
-        session.modified = True
+        drawn_cards_info = draw_cards()
 
-        prompt = create_tarot_prompt(question, drawn_cards_info, history_string)
-        reading, error = get_gemini_reading(prompt)
+        cache_key = get_reading_cache_key(question, drawn_cards_info)
+        if cache_key:
+            reading, error = reading_cache.get_or_compute(
+                cache_key, lambda: get_gemini_reading(create_tarot_prompt(question, drawn_cards_info)))
+        else:
+            prompt = create_tarot_prompt(question, drawn_cards_info)
+            reading, error = get_gemini_reading(prompt)
 
         if error:
             return jsonify({'error': error}), 500
 
-        # Prepare card data for the frontend
-        past_card, present_card, future_card = drawn_cards_info[0], drawn_cards_info[1], drawn_cards_info[2]
-        response_cards = {
-            'past': format_card_for_response(past_card),
-            'present': format_card_for_response(present_card),
-            'future': format_card_for_response(future_card)
-        }
+        response_cards = format_spread_for_response(drawn_cards_info)
 
     else: # mode == 'chat'
         # --- CHAT MODE: Use last drawn cards for a follow-up --- 
@@ -157,7 +172,7 @@ def chat():
         if not last_cards:
             return jsonify({'reading': g.translations.get('noCardsDrawnError', 'You need to ask a tarot question first to draw some cards!')}), 200
 
-        prompt = create_chat_prompt(question, last_cards, history_string)
+        prompt = create_chat_prompt(question, last_cards)
         reading, error = get_gemini_reading(prompt)
 
         if error:
@@ -165,119 +180,200 @@ def chat():
         
         response_cards = None # No new cards are sent in chat mode
 
+    update_history(question, reading)
+    metrics.RESPONSE_CHARS.observe(len(reading), mode=mode)
 
+    # --- Prepare and Send Response ---
+    response_data = {
+        'reading': reading,
+        'cards': response_cards
+    }
+    with metrics.phase('serialize'):
+        return jsonify(response_data)
 
+@app.route('/chat/stream', methods=['POST'])
+def chat_stream():
+    """Streaming variant of /chat.
 
+    Sends the drawn cards first (tarot mode), then the reading as it is
+    generated. The events are `cards`, `token`, `done` and `error`. The
+    history is only updated once the whole reading has streamed.
+    """
+    data = request.get_json()
+    question = data.get('question')
+    mode = data.get('mode', 'tarot')
 
+    if not question:
+        return jsonify({'error': 'Question is required.'}), 400
 
+    if not catalog.cards:
+         return jsonify({'error': 'Tarot knowledge base is not loaded. Check server logs.'}), 500
 
-    # --- Update History ---
-    session['history'].append({'question': question, 'reading': reading})
-    if len(session['history']) > 3: # Keep history to the last 3 interactions
-        session['history'].pop(0)
+    if not api_configured:
+        return jsonify({'error': 'API not configured. Check .env file.'}), 500
+
+    cache_key = None
+    if mode == 'tarot':
+        drawn_cards_info = draw_cards()
+        cache_key = get_reading_cache_key(question, drawn_cards_info)
+        prompt_factory = lambda: create_tarot_prompt(question, drawn_cards_info)
+        response_cards = format_spread_for_response(drawn_cards_info)
+    else:
+        last_cards = session.get('last_cards')
+        if not last_cards:
+            message = g.translations.get('noCardsDrawnError', 'You need to ask a tarot question first to draw some cards!')
+            events = [sse_event('token', {'text': message}), sse_event('done', {})]
+            return Response(events, mimetype='text/event-stream')
+
+        prompt_factory = lambda: create_chat_prompt(question, last_cards)
+        response_cards = None
+
+    def generate():
+        if response_cards:
+            yield sse_event('cards', response_cards)
+        if cache_key:
+            reading_chunks = reading_cache.stream_or_compute(cache_key, lambda: get_gemini_stream(prompt_factory()))
+        else:
+            reading_chunks = get_gemini_stream(prompt_factory())
+        chunks = []
+        try:
+            for text in reading_chunks:
+                chunks.append(text)
+                yield sse_event('token', {'text': text})
+        except Exception as e:
+            print(f"Streaming reading failed: {e}")
+            yield sse_event('error', {'error': str(e)})
+            return
+        # The session was saved when the headers went out, so save the history
+        # again, keeping whatever other requests changed meanwhile (e.g. the language)
+        reading = ''.join(chunks)
+        metrics.RESPONSE_CHARS.observe(len(reading), mode=mode)
+        update_history(question, reading)
+        app.session_interface.persist(session, keys=('last_exchange', 'summary'))
+        yield sse_event('done', {})
+
+    headers = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    return Response(stream_with_context(generate()), mimetype='text/event-stream', headers=headers)
+
+@app.route('/bulk/readings', methods=['POST'])
+def bulk_readings():
+    """Generates readings for many items, streamed back as NDJSON.
+
+    The body is {"items": [...], "done": [IDs to skip]}, see app/bulk.py for
+    the item format. Only enabled when BULK_API_TOKEN is set, and requires
+    `Authorization: Bearer <BULK_API_TOKEN>`.
+    """
+    if not has_bearer_token(bulk_api_token):
+        return jsonify({'error': 'Not authorized.'}), 403
+
+    if not catalog.cards:
+         return jsonify({'error': 'Tarot knowledge base is not loaded. Check server logs.'}), 500
+
+    if not api_configured:
+        return jsonify({'error': 'API not configured. Check .env file.'}), 500
+
+    data = request.get_json(silent=True) or {}
+    items = data.get('items')
+    done_ids = data.get('done', [])
+    if not isinstance(items, list) or not isinstance(done_ids, list):
+        return jsonify({'error': '`items` and `done` must be lists.'}), 400
+
+    runner = BulkRunner(catalog, key_scheduler, LANGUAGES)
+    lines = (json.dumps(result, ensure_ascii=False) + "\n" for result in runner.run(items, done_ids))
+    # Keep the request context so card image URLs are built with this request's SCRIPT_NAME
+    return Response(stream_with_context(lines), mimetype='application/x-ndjson', headers={'X-Accel-Buffering': 'no'})
+
+# --- Helper Functions for Conversation State ---
+
+def update_history(question, reading):
+    """Makes this exchange the most recent one and folds the previous one
+    into the rolling summary."""
+    last_exchange = session.get('last_exchange')
+    if last_exchange:
+        session['summary'] = prompts.add_to_summary(session.get('summary', []), last_exchange['question'], last_exchange['reading'])
+    session['last_exchange'] = {'question': question, 'reading': reading}
     session.modified = True
 
-    # --- Prepare and Send Response ---
-    response_data = {
-        'reading': reading,
-        'cards': response_cards
-    }
-    return jsonify(response_data)
+def get_reading_cache_key(question, drawn_cards):
+    """Returns the reading cache key, or None when the reading can't be shared.
+
+    Only first readings are cached: once there is a conversation history the
+    reading refers back to it and is specific to this user.
+    """
+    if reading_cache is None or session.get('last_exchange'):
+        return None
+    return make_key(g.locale, drawn_cards, question)
+
+def draw_cards():
+    """Draws a three card spread and remembers it for follow-up questions.
+
+    Cards are (index into the knowledge base, orientation) pairs; the catalog
+    resolves them to names, meanings and images.
+    """
+    with metrics.phase('draw'):
+        drawn_cards_info = catalog.draw()
+
+    session['last_cards'] = drawn_cards_info  # Save cards to session
+    session.modified = True
+    return drawn_cards_info
 
 # --- Helper Functions for Prompt Generation ---
 
-def get_card_meaning(card_info):
-    card_name = card_info['name']
-    orientation = card_info['orientation'].lower()
-    knowledge = TAROT_KNOWLEDGE_BASE.get(card_name, {})
-    return knowledge.get('meanings', {}).get(orientation, "No specific meaning found.")
+def get_card_entry(card_info):
+    index, orientation = card_info
+    return catalog.card(index, orientation, g.locale)
 
 def format_card_for_response(card_info):
-    translations = g.translations
-    card_name = translations['card_names'].get(card_info['name'], card_info['name'])
-    orientation = translations.get(card_info['orientation'].lower(), card_info['orientation'])
-    return {'name': card_name, 'img': url_for('static', filename=f'images/{card_info["img"]}'), 'orientation': orientation}
-
-def create_tarot_prompt(question, drawn_cards, history):
-    translations = g.translations
-    language_name = LANGUAGES.get(g.locale, 'English')
+    return catalog.response(get_card_entry(card_info))
 
+def format_spread_for_response(drawn_cards):
+    # Prepare card data for the frontend
     past_card, present_card, future_card = drawn_cards[0], drawn_cards[1], drawn_cards[2]
-    past_meaning = get_card_meaning(past_card)
-    present_meaning = get_card_meaning(present_card)
-    future_meaning = get_card_meaning(future_card)
-
-    past_card_fmt = format_card_for_response(past_card)
-    present_card_fmt = format_card_for_response(present_card)
-    future_card_fmt = format_card_for_response(future_card)
-
-    return (
-        f"You are {translations['aiName']}, a kind, cute, and professional tarot-reading cat. "
-        f"You MUST use the provided context to interpret the cards. Do not use your own general knowledge of tarot.\n\n"
-        f"Here is the user's conversation history:\n{history}\n"
-        f"The user's NEW question is: '{question}'\n\n"
-        f"You have drawn three cards. Here is the relevant knowledge for each card:\n"
-        f"1. {translations['past']}: {past_card_fmt['name']} ({past_card_fmt['orientation']}) - Meaning: {past_meaning}\n"
-        f"2. {translations['present']}: {present_card_fmt['name']} ({present_card_fmt['orientation']}) - Meaning: {present_meaning}\n"
-        f"3. {translations['future']}: {future_card_fmt['name']} ({future_card_fmt['orientation']}) - Meaning: {future_meaning}\n\n"
-        f"INSTRUCTIONS:\n"
-        f"1. Give a nice, friendly, and comforting greeting. As a cat, use cute cat-themed emojis to express your cat-like actions and feelings instead of plaintext.\n"
-        f"2. Provide a gentle, comforting, and insightful interpretation based ONLY on the meanings provided.\n"
-        f"3. Directly relate your interpretation to the user's new question: '{question}'.\n"
-        f"4. **If the conversation history is not empty, briefly acknowledge the previous topics and relate this new reading to the ongoing conversation to provide a continuous experience.**\n"
-        f"5. Structure your response with clear headings for each card position (Past, Present, Future) and the card name. These headings MUST be bold (e.g., `**{translations['past']}**`).\n"
-        f"6. Provide a comprehensive and inspiring summary at the end.\n"
-        f"7. Do not mention the time or date in the response unless asked.\n"
-        f"8. Respond entirely in {language_name} using Markdown format."
-    )
-
-def create_chat_prompt(question, last_cards, history):
-    translations = g.translations
-    language_name = LANGUAGES.get(g.locale, 'English')
-
-    card_details = []
-    for card in last_cards:
-        card_fmt = format_card_for_response(card)
-        meaning = get_card_meaning(card)
-        card_details.append(f"- {card_fmt['name']} ({card_fmt['orientation']}): {meaning}")
-    card_knowledge = "\n".join(card_details)
-
-    return (
-        f"You are {translations['aiName']}, a kind, cute, and professional tarot-reading cat.\n"
-        f"The user is asking a follow-up question about a previous tarot reading.\n\n"
-        f"Here is the user's conversation history:\n{history}\n"
-        f"The cards from the last reading were:\n{card_knowledge}\n\n"
-        f"The user's NEW follow-up question is: '{question}'\n\n"
-        f"INSTRUCTIONS:\n"
-        f"1. Do NOT draw new cards. Your response MUST be based on the cards from the last reading.\n"
-        f"2. **Crucially, you must explicitly reference the user's previous question and your previous answer (from the history) and explain how the cards' meanings connect to this NEW follow-up question.**\n"
-        f"3. Provide a comforting, insightful, and concise answer. As a cat, use cute cat-themed emojis to express your cat-like actions and feelings instead of plain text.\n"
-        f"4. Keep your response focused and directly answer the user's new question: '{question}'.\n"
-        f"5. Do not mention the time or date in the response unless asked.\n"
-        f"6. Respond entirely in {language_name} using Markdown format."
-    )
+    return {
+        'past': format_card_for_response(past_card),
+        'present': format_card_for_response(present_card),
+        'future': format_card_for_response(future_card)
+    }
+
+def create_tarot_prompt(question, drawn_cards):
+    with metrics.phase('prompt'):
+        cards = [get_card_entry(card) for card in drawn_cards]
+        prompt, token_count = prompts.build_tarot_prompt(
+            question, cards, session.get('summary', []), session.get('last_exchange'),
+            g.translations, LANGUAGES.get(g.locale, 'English'))
+    metrics.PROMPT_TOKENS.observe(token_count, mode='tarot')
+    print(f"Prompt tokens: {token_count} (tarot, {g.locale})")
+    return prompt
+
+def create_chat_prompt(question, last_cards):
+    with metrics.phase('prompt'):
+        cards = [get_card_entry(card) for card in last_cards]
+        prompt, token_count = prompts.build_chat_prompt(
+            question, cards, session.get('summary', []), session.get('last_exchange'),
+            g.translations, LANGUAGES.get(g.locale, 'English'))
+    metrics.PROMPT_TOKENS.observe(token_count, mode='chat')
+    print(f"Prompt tokens: {token_count} (chat, {g.locale})")
+    return prompt
 
 def get_gemini_reading(prompt):
     if not api_configured:
         return None, 'API not configured. Check .env file.'
 
-    result_queue = queue.Queue()
-    threads = []
-    for key in api_keys:
-        thread = threading.Thread(target=get_gemini_response, args=(key, prompt, result_queue))
-        threads.append(thread)
-        thread.start()
-
+    timings = {}
     try:
-        result = result_queue.get(timeout=15)
-        print(f"Fastest response from key ending in ...{result['key_used'][-4:]}")
-        return result['text'], None
-    except queue.Empty:
+        with metrics.phase('gemini'):
+            text, key_used = key_scheduler.generate(prompt, timings)
+        print(f"Fastest response from key ending in ...{key_used[-4:]}")
+        return text, None
+    except TimeoutError:
         print("All API keys failed or timed out.")
         return None, 'Could not get a response from the tarot spirits. Please try again.'
     except Exception as e:
         print(f"An unexpected error occurred: {e}")
-        return None, str(e)
+        return None, 'Could not get a response from the tarot spirits. Please try again.'
+    finally:
+        if 'queue' in timings:
+            metrics.record_phase('queue', timings['queue'])
 
 if __name__ == '__main__':
     app.run(debug=True)
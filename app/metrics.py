@@ -0,0 +1,265 @@
+import os
+import json
+import time
+import bisect
+import sqlite3
+import secrets
+import threading
+from contextlib import contextmanager
+
+from flask import Response, g, has_request_context
+
+from app.auth import has_bearer_token
+from app.database import Database
+
+FLUSH_INTERVAL = 5.0  # Seconds between writes of a worker's metrics to the shared database
+RETIRED_PROCESS = 'retired'  # Row that collects the totals of processes that have exited
+
+PHASE_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30)
+GEMINI_BUCKETS = (0.25, 0.5, 1, 2, 3, 4, 6, 8, 10, 15, 20, 30)
+TOKEN_BUCKETS = (100, 250, 500, 750, 1000, 1500, 2000, 3000, 5000)
+CHAR_BUCKETS = (250, 500, 1000, 2000, 3000, 4000, 6000, 8000, 12000)
+
+
+class Metric:
+    """One metric family. Samples are kept per label set in the registry."""
+
+    def __init__(self, registry, name, kind, help_text, buckets=None):
+        self.registry = registry
+        self.name = name
+        self.kind = kind
+        self.help_text = help_text
+        self.buckets = buckets
+
+    def observe(self, value, **labels):
+        """Adds `value` to a histogram."""
+        self.registry.update(self, labels, value)
+
+    def inc(self, amount=1, **labels):
+        """Adds `amount` to a counter."""
+        self.registry.update(self, labels, amount)
+
+
+class Registry:
+    """Counters and histograms, aggregated across gunicorn workers.
+
+    Each process updates plain lists in memory under a lock, which costs a
+    few microseconds per observation. Every FLUSH_INTERVAL seconds, at the end
+    of a request, the process writes its totals to a SQLite table under its
+    own row; /metrics adds up the rows of every process that ever wrote one.
+    Rows of processes that have exited are folded into one RETIRED_PROCESS
+    row, so the table doesn't grow with every worker restart.
+    """
+
+    def __init__(self):
+        self.metrics = {}
+        self.values = {}  # (name, sorted label items) -> [bucket counts..., +Inf count, sum] or [count]
+        self.lock = threading.Lock()
+        self.database = None
+        self.process_id = None
+        self.process_pid = None
+        self.next_flush = 0.0
+
+    def histogram(self, name, help_text, buckets):
+        metric = Metric(self, name, 'histogram', help_text, tuple(buckets))
+        self.metrics[name] = metric
+        return metric
+
+    def counter(self, name, help_text):
+        metric = Metric(self, name, 'counter', help_text)
+        self.metrics[name] = metric
+        return metric
+
+    def update(self, metric, labels, value):
+        key = (metric.name, tuple(sorted(labels.items())))
+        with self.lock:
+            sample = self.values.get(key)
+            if sample is None:
+                size = len(metric.buckets) + 2 if metric.buckets else 1
+                sample = self.values[key] = [0] * size
+            if metric.buckets:
+                sample[bisect.bisect_left(metric.buckets, value)] += 1
+                sample[-1] += value
+            else:
+                sample[0] += value
+
+    # --- Sharing between workers ---
+
+    def open(self, path):
+        self.database = Database(path, (
+            'CREATE TABLE IF NOT EXISTS samples (process TEXT NOT NULL, name TEXT NOT NULL, labels TEXT NOT NULL, value TEXT NOT NULL, PRIMARY KEY (process, name, labels))',
+        ))
+
+    def flush(self):
+        if self.database is None:
+            return
+        if self.process_pid != os.getpid():
+            # PIDs get reused across restarts, so each process writes under a fresh ID
+            self.process_id = f"{os.getpid()}-{secrets.token_hex(4)}"
+            self.process_pid = os.getpid()
+        with self.lock:
+            rows = [(self.process_id, name, json.dumps(labels), json.dumps(sample)) for (name, labels), sample in self.values.items()]
+        db = self.database.db
+        # IMMEDIATE takes the write lock up front, so two workers never retire the same rows
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            db.executemany('INSERT OR REPLACE INTO samples (process, name, labels, value) VALUES (?, ?, ?, ?)', rows)
+            self.retire_exited(db)
+            db.execute('COMMIT')
+        except BaseException:
+            db.execute('ROLLBACK')
+            raise
+
+    def retire_exited(self, db):
+        """Adds the rows of processes that no longer run to the RETIRED_PROCESS row."""
+        exited = [process for (process,) in db.execute('SELECT DISTINCT process FROM samples')
+                  if process != RETIRED_PROCESS and not process_alive(process)]
+        if not exited:
+            return
+        retired = {(name, labels): json.loads(value) for name, labels, value in
+                   db.execute('SELECT name, labels, value FROM samples WHERE process = ?', (RETIRED_PROCESS,))}
+        for process in exited:
+            for name, labels, value in db.execute('SELECT name, labels, value FROM samples WHERE process = ?', (process,)).fetchall():
+                sample = json.loads(value)
+                total = retired.get((name, labels))
+                retired[name, labels] = [a + b for a, b in zip(total, sample)] if total and len(total) == len(sample) else sample
+            db.execute('DELETE FROM samples WHERE process = ?', (process,))
+        db.executemany('INSERT OR REPLACE INTO samples (process, name, labels, value) VALUES (?, ?, ?, ?)',
+                       [(RETIRED_PROCESS, name, labels, json.dumps(sample)) for (name, labels), sample in retired.items()])
+        print(f"Folded the metrics of {len(exited)} exited process(es) into the retired totals.")
+
+    def maybe_flush(self):
+        now = time.monotonic()
+        if now < self.next_flush:
+            return
+        self.next_flush = now + FLUSH_INTERVAL
+        self.try_flush()
+
+    def try_flush(self):
+        try:
+            self.flush()
+        except sqlite3.Error as e:
+            print(f"Could not write metrics: {e}")
+
+    def collect(self):
+        """Returns {(name, label items): summed sample} over all processes."""
+        if self.database is None:
+            with self.lock:
+                return {key: list(sample) for key, sample in self.values.items()}
+        self.try_flush()
+        totals = {}
+        for name, labels, value in self.database.db.execute('SELECT name, labels, value FROM samples'):
+            key = (name, tuple(tuple(item) for item in json.loads(labels)))
+            sample = json.loads(value)
+            if key in totals and len(totals[key]) == len(sample):
+                totals[key] = [a + b for a, b in zip(totals[key], sample)]
+            else:
+                totals[key] = sample
+        return totals
+
+    def render(self):
+        """Formats every metric in the Prometheus text exposition format."""
+        samples = {}
+        for (name, labels), sample in self.collect().items():
+            samples.setdefault(name, []).append((labels, sample))
+
+        lines = []
+        for name, metric in self.metrics.items():
+            lines.append(f"# HELP {name} {metric.help_text}")
+            lines.append(f"# TYPE {name} {metric.kind}")
+            for labels, sample in sorted(samples.get(name, [])):
+                if metric.kind == 'counter':
+                    lines.append(f"{name}{format_labels(labels)} {format_value(sample[0])}")
+                    continue
+                if len(sample) != len(metric.buckets) + 2:
+                    continue  # Written by a process with different buckets
+                cumulative = 0
+                for bound, count in zip(metric.buckets + ('+Inf',), sample):
+                    cumulative += count
+                    lines.append(f"{name}_bucket{format_labels(labels + (('le', format_value(bound)),))} {cumulative}")
+                lines.append(f"{name}_sum{format_labels(labels)} {format_value(sample[-1])}")
+                lines.append(f"{name}_count{format_labels(labels)} {cumulative}")
+        return "\n".join(lines) + "\n"
+
+
+def process_alive(process):
+    """Whether the process that wrote rows as `process` ("<pid>-<random>") still runs."""
+    try:
+        os.kill(int(process.split('-')[0]), 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass  # Exists, but belongs to another user
+    except ValueError:
+        return True  # Not written by flush(); leave it alone
+    return True
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in labels)
+    return '{' + ','.join(f'{key}="{value}"' for (key, _), value in zip(labels, escaped)) + '}'
+
+
+def format_value(value):
+    if isinstance(value, str):
+        return value
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+registry = Registry()
+
+PHASE_SECONDS = registry.histogram('tarotmeow_phase_seconds', 'Time spent in each phase of a chat request.', PHASE_BUCKETS)
+GEMINI_SECONDS = registry.histogram('tarotmeow_gemini_seconds', 'Latency of successful Gemini calls, per API key.', GEMINI_BUCKETS)
+GEMINI_CALLS = registry.counter('tarotmeow_gemini_calls_total', 'Gemini calls per API key and outcome (success, timeout, rate_limited, invalid_key, error, request_error, cancelled).')
+PROMPT_TOKENS = registry.histogram('tarotmeow_prompt_tokens', 'Estimated prompt size in tokens.', TOKEN_BUCKETS)
+RESPONSE_CHARS = registry.histogram('tarotmeow_response_chars', 'Reading size in characters.', CHAR_BUCKETS)
+READING_CACHE = registry.counter('tarotmeow_reading_cache_total', 'Reading cache lookups by outcome: hit, miss, and coalesced (hits that waited for another request).')
+READING_CACHE_SECONDS = registry.histogram('tarotmeow_reading_cache_seconds', 'Time to a cached reading (hit, coalesced) or to a generated one (miss).', PHASE_BUCKETS)
+
+
+# --- Request phases ---
+
+def record_phase(name, seconds):
+    """Adds a phase timing to the histogram and to this request's Server-Timing."""
+    PHASE_SECONDS.observe(seconds, phase=name)
+    if has_request_context():
+        g.setdefault('timings', []).append((name, seconds))
+
+
+@contextmanager
+def phase(name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_phase(name, time.perf_counter() - start)
+
+
+def server_timing(response):
+    timings = g.get('timings')
+    if timings:
+        response.headers['Server-Timing'] = ', '.join(f"{name};dur={seconds * 1000:.1f}" for name, seconds in timings)
+    return response
+
+
+def init_app(app, path, token=None, server_timing_header=False):
+    """Shares metrics through the database at `path` and adds /metrics.
+
+    The endpoint requires `Authorization: Bearer <token>` and is disabled
+    without a token, since its labels identify the API keys. With
+    `server_timing_header`, responses carry a Server-Timing header with
+    the phases timed so far. Streamed responses send their headers before the
+    reading is generated, so they only include the phases up to that point.
+    """
+    registry.open(path)
+    def serve_metrics():
+        if not has_bearer_token(token):
+            return Response('Not authorized.\n', status=403, mimetype='text/plain')
+        return Response(registry.render(), mimetype='text/plain; version=0.0.4')
+
+    app.add_url_rule('/metrics', 'metrics', serve_metrics)
+    app.teardown_request(lambda error: registry.maybe_flush())
+    if server_timing_header:
+        app.after_request(server_timing)
@@ -0,0 +1,160 @@
+import os
+import re
+import math
+from functools import lru_cache
+
+# --- Prompt Budget Configuration ---
+PROMPT_TOKEN_BUDGET = int(os.getenv('PROMPT_TOKEN_BUDGET', '2000'))
+SUMMARY_TOKEN_BUDGET = int(os.getenv('SUMMARY_TOKEN_BUDGET', '400'))  # Rolling summary of older readings
+SUMMARY_ENTRY_TOKENS = 60  # Per summarized reading
+
+# CJK characters are roughly a token each; other words are roughly one token
+# per four characters. Close enough to Gemini's tokenizer for budgeting.
+TOKEN_PATTERN = re.compile(r'[\u3040-\u30ff\u3400-\u9fff\uf900-\ufaff\uac00-\ud7af]|\w+|[^\w\s]')
+MARKDOWN_PATTERN = re.compile(r'[*_#>`]+')
+
+
+def token_cost(piece):
+    if piece[0].isascii() and piece[0].isalnum():
+        return math.ceil(len(piece) / 4)
+    return 1
+
+
+def count_tokens(text):
+    """Estimates the number of Gemini tokens in `text` without calling the API."""
+    return sum(token_cost(match.group()) for match in TOKEN_PATTERN.finditer(text))
+
+
+def truncate_to_tokens(text, max_tokens):
+    used = 0
+    for match in TOKEN_PATTERN.finditer(text):
+        used += token_cost(match.group())
+        if used > max_tokens:
+            return text[:match.start()].rstrip() + '…'
+    return text
+
+
+# --- Conversation Summary ---
+
+def summarize_reading(question, reading, max_tokens=SUMMARY_ENTRY_TOKENS):
+    """Boils a finished reading down to one line.
+
+    Readings end with a summary paragraph (see the instructions below), so
+    that paragraph is kept as the gist of the answer.
+    """
+    paragraphs = [p.strip() for p in MARKDOWN_PATTERN.sub('', reading).split('\n') if p.strip()]
+    gist = paragraphs[-1] if paragraphs else ''
+    return truncate_to_tokens(f"Q: {question} → {gist}", max_tokens)
+
+
+def add_to_summary(summary, question, reading, budget=SUMMARY_TOKEN_BUDGET):
+    """Returns `summary` with one more reading folded in.
+
+    Each reading is summarized once, when it leaves the most recent slot, and
+    the oldest entries are dropped once the summary goes over budget.
+    """
+    summary = summary + [summarize_reading(question, reading)]
+    while len(summary) > 1 and sum(count_tokens(entry) for entry in summary) > budget:
+        summary.pop(0)
+    return summary
+
+
+def format_history(summary, last_exchange, budget):
+    """Fits the conversation history into `budget` tokens.
+
+    The previous exchange is included verbatim when it fits, since follow-up
+    questions usually refer to it, and its one-line summary otherwise. Older
+    readings fill whatever budget is left, newest first.
+    """
+    if not last_exchange:
+        return ""
+
+    last = f"Previous Question: {last_exchange['question']}\nPrevious Reading: {last_exchange['reading']}\n"
+    if count_tokens(last) > budget:
+        last = f"Previous Reading (summary): {summarize_reading(last_exchange['question'], last_exchange['reading'])}\n"
+    remaining = budget - count_tokens(last)
+
+    earlier = []
+    for entry in reversed(summary):
+        cost = count_tokens(entry) + 1
+        if cost > remaining:
+            break
+        earlier.insert(0, f"- {entry}")
+        remaining -= cost
+
+    if not earlier:
+        return last
+    return "Summary of earlier readings:\n" + "\n".join(earlier) + "\n" + last
+
+
+# --- Static Instruction Prefixes ---
+# The persona and instructions only depend on the mode and locale, so they are
+# built once and always open the prompt as an identical prefix.
+
+@lru_cache(maxsize=None)
+def tarot_prefix(ai_name, past_label, language_name):
+    return (
+        f"You are {ai_name}, a kind, cute, and professional tarot-reading cat. "
+        f"You MUST use the provided context to interpret the cards. Do not use your own general knowledge of tarot.\n\n"
+        f"INSTRUCTIONS:\n"
+        f"1. Give a nice, friendly, and comforting greeting. As a cat, use cute cat-themed emojis to express your cat-like actions and feelings instead of plaintext.\n"
+        f"2. Provide a gentle, comforting, and insightful interpretation based ONLY on the meanings provided.\n"
+        f"3. Directly relate your interpretation to the user's new question, given at the end.\n"
+        f"4. **If the conversation history is not empty, briefly acknowledge the previous topics and relate this new reading to the ongoing conversation to provide a continuous experience.**\n"
+        f"5. Structure your response with clear headings for each card position (Past, Present, Future) and the card name. These headings MUST be bold (e.g., `**{past_label}**`).\n"
+        f"6. Provide a comprehensive and inspiring summary at the end.\n"
+        f"7. Do not mention the time or date in the response unless asked.\n"
+        f"8. Respond entirely in {language_name} using Markdown format.\n\n"
+    )
+
+
+@lru_cache(maxsize=None)
+def chat_prefix(ai_name, language_name):
+    return (
+        f"You are {ai_name}, a kind, cute, and professional tarot-reading cat.\n"
+        f"The user is asking a follow-up question about a previous tarot reading.\n\n"
+        f"INSTRUCTIONS:\n"
+        f"1. Do NOT draw new cards. Your response MUST be based on the cards from the last reading.\n"
+        f"2. **Crucially, you must explicitly reference the user's previous question and your previous answer (from the history) and explain how the cards' meanings connect to this NEW follow-up question.**\n"
+        f"3. Provide a comforting, insightful, and concise answer. As a cat, use cute cat-themed emojis to express your cat-like actions and feelings instead of plain text.\n"
+        f"4. Keep your response focused and directly answer the user's new question, given at the end.\n"
+        f"5. Do not mention the time or date in the response unless asked.\n"
+        f"6. Respond entirely in {language_name} using Markdown format.\n\n"
+    )
+
+
+# --- Prompt Assembly ---
+
+def build_tarot_prompt(question, cards, summary, last_exchange, translations, language_name, budget=PROMPT_TOKEN_BUDGET):
+    """Returns (prompt, token_count) for a new three card reading.
+
+    `cards` are the catalog entries for the past, present and future cards.
+    """
+    past_card, present_card, future_card = cards
+    prefix = tarot_prefix(translations['aiName'], translations['past'], language_name)
+    card_knowledge = (
+        f"You have drawn three cards. Here is the relevant knowledge for each card:\n"
+        f"1. {translations['past']}: {past_card.name} ({past_card.orientation}) - Meaning: {past_card.meaning}\n"
+        f"2. {translations['present']}: {present_card.name} ({present_card.orientation}) - Meaning: {present_card.meaning}\n"
+        f"3. {translations['future']}: {future_card.name} ({future_card.orientation}) - Meaning: {future_card.meaning}\n\n"
+        f"The user's NEW question is: '{question}'"
+    )
+    return assemble(prefix, card_knowledge, summary, last_exchange, budget)
+
+
+def build_chat_prompt(question, cards, summary, last_exchange, translations, language_name, budget=PROMPT_TOKEN_BUDGET):
+    """Returns (prompt, token_count) for a follow-up about the last cards drawn."""
+    prefix = chat_prefix(translations['aiName'], language_name)
+    card_details = "\n".join(f"- {card.name} ({card.orientation}): {card.meaning}" for card in cards)
+    card_knowledge = (
+        f"The cards from the last reading were:\n{card_details}\n\n"
+        f"The user's NEW follow-up question is: '{question}'"
+    )
+    return assemble(prefix, card_knowledge, summary, last_exchange, budget)
+
+
+def assemble(prefix, card_knowledge, summary, last_exchange, budget):
+    fixed_tokens = count_tokens(prefix) + count_tokens(card_knowledge) + 10  # + history heading
+    history = format_history(summary, last_exchange, max(budget - fixed_tokens, 0))
+    prompt = f"{prefix}Here is the user's conversation history:\n{history}\n{card_knowledge}"
+    return prompt, count_tokens(prompt)
@@ -0,0 +1,183 @@
+import json
+import time
+import hashlib
+import threading
+import unicodedata
+
+from app import metrics
+from app.database import Database
+from app.key_scheduler import REQUEST_TIMEOUT, STREAM_TIMEOUT
+
+# How long a worker may hold the right to generate a reading: as long as the
+# slowest stream the scheduler allows, first chunk included
+LEASE_SECONDS = STREAM_TIMEOUT + REQUEST_TIMEOUT
+POLL_INTERVAL = 0.1
+EVICT_INTERVAL = 60.0
+
+
+def normalize_question(question):
+    """Reduces a question to a fingerprint that ignores case, punctuation,
+    emoji and spacing, so "Will I find love?" and "will i find love" match."""
+    text = unicodedata.normalize('NFKC', question).casefold()
+    kept = [ch if unicodedata.category(ch)[0] not in 'PSC' else ' ' for ch in text]
+    return ' '.join(''.join(kept).split())
+
+
+def make_key(locale, cards, question):
+    """Cache key for a reading of the ordered (card index, orientation) spread."""
+    payload = json.dumps([locale, [list(card) for card in cards], normalize_question(question)], ensure_ascii=False)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class ReadingCache:
+    """LRU + TTL cache of finished readings in SQLite, shared by all workers.
+
+    Concurrent requests for the same key are coalesced: the first one claims a
+    lease and calls Gemini, the others wait for its result. In-process waiters
+    block on an Event; other workers poll the database until the lease is gone.
+    """
+
+    def __init__(self, path, ttl, max_entries):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.flights = {}
+        self.next_eviction = 0.0
+
+        self.database = Database(path, (
+            'CREATE TABLE IF NOT EXISTS readings (key TEXT PRIMARY KEY, reading TEXT NOT NULL, created_at REAL NOT NULL, last_used_at REAL NOT NULL)',
+            'CREATE INDEX IF NOT EXISTS readings_last_used_at ON readings (last_used_at)',
+            'CREATE TABLE IF NOT EXISTS inflight (key TEXT PRIMARY KEY, expires_at REAL NOT NULL)',
+        ))
+
+    # --- Storage ---
+
+    def lookup(self, key):
+        now = time.time()
+        row = self.database.db.execute('SELECT reading FROM readings WHERE key = ? AND created_at > ?', (key, now - self.ttl)).fetchone()
+        if row is None:
+            return None
+        self.database.db.execute('UPDATE readings SET last_used_at = ? WHERE key = ?', (now, key))
+        return row[0]
+
+    def store(self, key, reading):
+        now = time.time()
+        self.database.db.execute('INSERT OR REPLACE INTO readings (key, reading, created_at, last_used_at) VALUES (?, ?, ?, ?)', (key, reading, now, now))
+        self.maybe_evict()
+
+    def maybe_evict(self):
+        now = time.monotonic()
+        if now < self.next_eviction:
+            return
+        self.next_eviction = now + EVICT_INTERVAL
+        self.database.db.execute('DELETE FROM readings WHERE created_at <= ?', (time.time() - self.ttl,))
+        # Least recently used entries beyond the size limit
+        self.database.db.execute(
+            'DELETE FROM readings WHERE key IN (SELECT key FROM readings ORDER BY last_used_at DESC LIMIT -1 OFFSET ?)',
+            (self.max_entries,))
+
+    # --- Single flight ---
+
+    def claim(self, key):
+        """Returns True if the caller should generate the reading for `key`."""
+        with self.lock:
+            if key in self.flights:
+                return False
+            self.flights[key] = threading.Event()
+        now = time.time()
+        try:
+            self.database.db.execute('DELETE FROM inflight WHERE key = ? AND expires_at <= ?', (key, now))
+            claimed = self.database.db.execute('INSERT OR IGNORE INTO inflight (key, expires_at) VALUES (?, ?)', (key, now + LEASE_SECONDS)).rowcount == 1
+        except BaseException:
+            # Don't leave waiters in this process blocked on a flight that never started
+            with self.lock:
+                self.flights.pop(key).set()
+            raise
+        if not claimed:
+            # Another worker is generating it
+            with self.lock:
+                self.flights.pop(key).set()
+        return claimed
+
+    def release(self, key):
+        self.database.db.execute('DELETE FROM inflight WHERE key = ?', (key,))
+        with self.lock:
+            self.flights.pop(key).set()
+
+    def wait(self, key):
+        """Waits for whoever holds the lease on `key`; returns its reading or None."""
+        deadline = time.monotonic() + LEASE_SECONDS
+        with self.lock:
+            event = self.flights.get(key)
+        if event is not None:
+            event.wait(LEASE_SECONDS)
+            return self.lookup(key)
+        while time.monotonic() < deadline:
+            reading = self.lookup(key)
+            if reading is not None:
+                return reading
+            if self.database.db.execute('SELECT 1 FROM inflight WHERE key = ? AND expires_at > ?', (key, time.time())).fetchone() is None:
+                return self.lookup(key)
+            time.sleep(POLL_INTERVAL)
+        return None
+
+    # --- Entry points ---
+
+    def record(self, outcome, start):
+        """Counts a lookup and its latency; `outcome` is hit, coalesced or miss."""
+        metrics.READING_CACHE.inc(outcome='miss' if outcome == 'miss' else 'hit')
+        if outcome == 'coalesced':
+            metrics.READING_CACHE.inc(outcome='coalesced')
+        metrics.READING_CACHE_SECONDS.observe(time.monotonic() - start, outcome=outcome)
+
+    def find(self, key):
+        """Returns (cached reading or None, whether the caller holds the lease, outcome)."""
+        reading = self.lookup(key)
+        if reading is not None:
+            return reading, False, 'hit'
+        if self.claim(key):
+            return None, True, 'miss'
+        reading = self.wait(key)
+        return reading, False, 'coalesced' if reading is not None else 'miss'
+
+    def get_or_compute(self, key, compute):
+        """Returns (reading, error) from the cache or from `compute()`."""
+        start = time.monotonic()
+        reading, leader, outcome = self.find(key)
+        if reading is not None:
+            self.record(outcome, start)
+            print(f"Reading cache hit in {(time.monotonic() - start) * 1000:.1f}ms")
+            return reading, None
+
+        try:
+            reading, error = compute()
+            if reading:
+                self.store(key, reading)
+        finally:
+            if leader:
+                self.release(key)
+        self.record('miss', start)
+        return reading, error
+
+    def stream_or_compute(self, key, stream):
+        """Yields the cached reading as one chunk, or the chunks of `stream()`."""
+        start = time.monotonic()
+        reading, leader, outcome = self.find(key)
+        if reading is not None:
+            self.record(outcome, start)
+            print(f"Reading cache hit in {(time.monotonic() - start) * 1000:.1f}ms")
+            yield reading
+            return
+
+        chunks = []
+        try:
+            for chunk in stream():
+                chunks.append(chunk)
+                yield chunk
+            reading = ''.join(chunks)
+            if reading:
+                self.store(key, reading)
+        finally:
+            if leader:
+                self.release(key)
+        self.record('miss', start)
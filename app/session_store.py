@@ -0,0 +1,159 @@
+import json
+import time
+import zlib
+import secrets
+
+from flask.sessions import SessionInterface, SessionMixin
+from werkzeug.datastructures import CallbackDict
+
+from app import metrics
+from app.database import Database
+
+EVICT_INTERVAL = 60.0  # Seconds between sweeps for expired sessions, per process
+
+
+class ServerSession(CallbackDict, SessionMixin):
+    """Session data kept on the server; the cookie only carries `sid`."""
+
+    def __init__(self, initial=None, sid=None, new=False):
+        def on_update(self):
+            self.modified = True
+
+        CallbackDict.__init__(self, initial, on_update)
+        self.sid = sid
+        self.new = new
+        self.modified = False
+
+
+class SessionStore:
+    """Where server-side sessions live. Subclasses implement storage.
+
+    Data is handed over as the compressed bytes to store, so backends don't
+    need to know anything about the session format.
+    """
+
+    def load(self, sid):
+        """Returns the stored bytes for `sid`, or None if missing or expired."""
+        raise NotImplementedError
+
+    def save(self, sid, data, expires_at):
+        raise NotImplementedError
+
+    def delete(self, sid):
+        raise NotImplementedError
+
+    def evict_expired(self):
+        raise NotImplementedError
+
+
+class SqliteSessionStore(SessionStore):
+    """Sessions in a SQLite database in WAL mode, shared by all gunicorn workers."""
+
+    def __init__(self, path):
+        self.database = Database(path, (
+            'CREATE TABLE IF NOT EXISTS sessions (sid TEXT PRIMARY KEY, data BLOB NOT NULL, expires_at REAL NOT NULL)',
+            'CREATE INDEX IF NOT EXISTS sessions_expires_at ON sessions (expires_at)',
+        ))
+
+    def load(self, sid):
+        row = self.database.db.execute('SELECT data FROM sessions WHERE sid = ? AND expires_at > ?', (sid, time.time())).fetchone()
+        return row[0] if row else None
+
+    def save(self, sid, data, expires_at):
+        self.database.db.execute('INSERT OR REPLACE INTO sessions (sid, data, expires_at) VALUES (?, ?, ?)', (sid, data, expires_at))
+
+    def delete(self, sid):
+        self.database.db.execute('DELETE FROM sessions WHERE sid = ?', (sid,))
+
+    def evict_expired(self):
+        return self.database.db.execute('DELETE FROM sessions WHERE expires_at <= ?', (time.time(),)).rowcount
+
+
+class ServerSideSessionInterface(SessionInterface):
+    """Keeps session data in a SessionStore and only a random ID in the cookie.
+
+    Any worker can serve any request, and the cookie stays a few dozen bytes
+    no matter how long the conversation gets. Sessions expire `ttl` seconds
+    after they were last written.
+    """
+
+    def __init__(self, store, ttl):
+        self.store = store
+        self.ttl = ttl
+        self.next_eviction = 0.0
+
+    def open_session(self, app, request):
+        sid = request.cookies.get(self.get_cookie_name(app))
+        if sid:
+            with metrics.phase('session'):
+                stored = self.read(sid)
+                if stored is not None:
+                    return ServerSession(stored, sid=sid)
+        return ServerSession(sid=secrets.token_urlsafe(32), new=True)
+
+    def read(self, sid):
+        """Returns the stored data for `sid`, or None. Unreadable rows are deleted."""
+        data = self.store.load(sid)
+        if data is None:
+            return None
+        try:
+            stored = json.loads(zlib.decompress(data))
+            if isinstance(stored, dict):
+                return stored
+            error = 'not a JSON object'
+        except (zlib.error, ValueError) as e:
+            error = e
+        print(f"Discarding unreadable session: {error}")
+        self.store.delete(sid)
+        return None
+
+    def persist(self, session, keys=None):
+        """Writes the session to the store, e.g. after a streamed response ends.
+
+        With `keys`, only those are taken from `session` and merged into the
+        stored copy, so changes other requests made meanwhile are kept.
+        """
+        with metrics.phase('session_save'):
+            values = dict(session)
+            if keys is not None:
+                stored = self.read(session.sid)
+                if stored is not None:
+                    values = dict(stored, **{key: session[key] for key in keys if key in session})
+            data = zlib.compress(json.dumps(values, ensure_ascii=False, separators=(',', ':')).encode('utf-8'))
+            self.store.save(session.sid, data, time.time() + self.ttl)
+        self.maybe_evict()
+
+    def maybe_evict(self):
+        now = time.monotonic()
+        if now < self.next_eviction:
+            return
+        self.next_eviction = now + EVICT_INTERVAL
+        evicted = self.store.evict_expired()
+        if evicted:
+            print(f"Evicted {evicted} expired session(s).")
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+
+        if not session:
+            if session.modified:
+                self.store.delete(session.sid)
+                response.delete_cookie(name, domain=domain, path=path)
+            return
+
+        if not self.should_set_cookie(app, session):
+            return
+
+        self.persist(session)
+        response.set_cookie(
+            name,
+            session.sid,
+            expires=self.get_expiration_time(app, session),
+            httponly=self.get_cookie_httponly(app),
+            domain=domain,
+            path=path,
+            secure=self.get_cookie_secure(app),
+            samesite=self.get_cookie_samesite(app),
+        )
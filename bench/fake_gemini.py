@@ -0,0 +1,157 @@
+"""Local stand-in for the Gemini GenerateContent API.
+
+Speaks the same gRPC service as generativelanguage.googleapis.com, so the app
+talks to it through the real SDK. Start it and point the app at it with
+
+    python bench/fake_gemini.py --port 50051 --latency-median 3 --rate-limit-rate 0.05
+    GEMINI_API_ENDPOINT=localhost:50051 GEMINI_API_KEY_1=fake-key-1 python3 -m app.main
+
+Latency is drawn from a lognormal distribution; streamed responses send
+their first chunk after --first-token and spread the rest of it over the
+remaining chunks. Errors and 429s are injected
+at configurable rates, and any of it can be overridden per API key with
+--key SUFFIX:field=value,... (e.g. --key 0001:latency_median=8,error_rate=0.5).
+"""
+import argparse
+import asyncio
+import math
+import random
+import signal
+
+import grpc
+from google.ai import generativelanguage as glm
+
+SERVICE_NAME = 'google.ai.generativelanguage.v1beta.GenerativeService'
+
+READING_WORDS = (
+    "The cards whisper softly 🐾 and the path ahead glows with gentle light. "
+    "**Past** shows the roots of your question, **Present** the choice before you, "
+    "and **Future** a hopeful turn if you trust your intuition. 😺 "
+).split()
+
+
+class Behaviour:
+    """How the fake server responds; one instance per API key override."""
+
+    fields = ('latency_median', 'latency_sigma', 'first_token', 'token_interval',
+              'words', 'error_rate', 'rate_limit_rate')
+
+    def __init__(self, args):
+        for field in self.fields:
+            setattr(self, field, getattr(args, field))
+
+    def override(self, spec):
+        behaviour = Behaviour(self)
+        for assignment in spec.split(','):
+            field, value = assignment.split('=')
+            if field not in self.fields:
+                raise ValueError(f"Unknown key behaviour field: {field}")
+            setattr(behaviour, field, type(getattr(self, field))(value))
+        return behaviour
+
+    def latency(self):
+        return random.lognormvariate(math.log(self.latency_median), self.latency_sigma)
+
+    async def maybe_fail(self, context):
+        roll = random.random()
+        if roll < self.rate_limit_rate:
+            await context.abort(grpc.StatusCode.RESOURCE_EXHAUSTED, 'Resource has been exhausted (e.g. check quota).')
+        if roll < self.rate_limit_rate + self.error_rate:
+            await context.abort(grpc.StatusCode.UNAVAILABLE, 'The service is currently unavailable.')
+
+    def text(self):
+        return ' '.join(random.choice(READING_WORDS) for _ in range(self.words))
+
+
+def make_response(text):
+    content = glm.Content(parts=[glm.Part(text=text)], role='model')
+    return glm.GenerateContentResponse(candidates=[glm.Candidate(content=content, finish_reason=glm.Candidate.FinishReason.STOP, index=0)])
+
+
+class FakeGemini:
+    def __init__(self, default, per_key):
+        self.default = default
+        self.per_key = per_key
+
+    def behaviour_for(self, context):
+        api_key = dict(context.invocation_metadata()).get('x-goog-api-key', '')
+        for suffix, behaviour in self.per_key.items():
+            if api_key.endswith(suffix):
+                return behaviour
+        return self.default
+
+    async def generate_content(self, request, context):
+        behaviour = self.behaviour_for(context)
+        await behaviour.maybe_fail(context)
+        await asyncio.sleep(behaviour.latency())
+        return make_response(behaviour.text())
+
+    async def stream_generate_content(self, request, context):
+        behaviour = self.behaviour_for(context)
+        await behaviour.maybe_fail(context)
+        total = behaviour.latency()
+        first_token = min(behaviour.first_token, total)
+        await asyncio.sleep(first_token)
+        # Spread the rest of the sampled latency over the streamed chunks,
+        # but never stream faster than --token-interval allows
+        words = behaviour.text().split(' ')
+        chunk_size = 8
+        chunks = math.ceil(len(words) / chunk_size)
+        interval = max((total - first_token) / max(chunks - 1, 1), behaviour.token_interval * chunk_size)
+        for index, start in enumerate(range(0, len(words), chunk_size)):
+            if index:
+                await asyncio.sleep(interval)
+            yield make_response(' '.join(words[start:start + chunk_size]) + ' ')
+
+    def handler(self):
+        return grpc.method_handlers_generic_handler(SERVICE_NAME, {
+            'GenerateContent': grpc.unary_unary_rpc_method_handler(
+                self.generate_content,
+                request_deserializer=glm.GenerateContentRequest.deserialize,
+                response_serializer=glm.GenerateContentResponse.serialize),
+            'StreamGenerateContent': grpc.unary_stream_rpc_method_handler(
+                self.stream_generate_content,
+                request_deserializer=glm.GenerateContentRequest.deserialize,
+                response_serializer=glm.GenerateContentResponse.serialize),
+        })
+
+
+async def serve(args):
+    default = Behaviour(args)
+    per_key = {}
+    for spec in args.key:
+        suffix, overrides = spec.split(':', 1)
+        per_key[suffix] = default.override(overrides)
+
+    server = grpc.aio.server()
+    server.add_generic_rpc_handlers((FakeGemini(default, per_key).handler(),))
+    server.add_insecure_port(f"{args.host}:{args.port}")
+    await server.start()
+    print(f"Fake Gemini listening on {args.host}:{args.port}", flush=True)
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    await stop.wait()
+    await server.stop(grace=1)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=50051)
+    parser.add_argument('--latency-median', type=float, default=3.0, help='Median seconds for a full response')
+    parser.add_argument('--latency-sigma', type=float, default=0.4, help='Lognormal sigma of the response latency')
+    parser.add_argument('--first-token', type=float, default=0.5, help='Seconds before the first streamed chunk (at most the sampled latency)')
+    parser.add_argument('--token-interval', type=float, default=0.01, help='Seconds between streamed words')
+    parser.add_argument('--words', type=int, default=300, help='Words per reading')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Fraction of calls failing with UNAVAILABLE')
+    parser.add_argument('--rate-limit-rate', type=float, default=0.0, help='Fraction of calls failing with 429')
+    parser.add_argument('--key', action='append', default=[], metavar='SUFFIX:FIELD=VALUE,...',
+                        help='Override behaviour for API keys ending in SUFFIX')
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    asyncio.run(serve(parse_args()))
@@ -0,0 +1,304 @@
+"""Offline load test for /chat against bench/fake_gemini.py.
+
+For every gunicorn configuration given with --config, starts the fake Gemini
+server and the app under gunicorn, then drives /chat with concurrent sessions.
+Each session asks a tarot question followed by --followups chat questions.
+Reports p50/p95/p99 latency and requests/sec per mode, plus peak threads and
+RSS per gunicorn worker (read from /proc, so Linux only). With --stream the
+sessions use /chat/stream, like the browser does, and time to first token
+is reported as well.
+
+    python bench/loadtest.py --config gthread:1:200 --config sync:4 --sessions 50 --duration 30
+
+A config is WORKER_CLASS[:WORKERS[:THREADS]]. Fake Gemini options can be
+passed through after `--`, e.g. `-- --latency-median 5 --rate-limit-rate 0.1`.
+With --url the harness targets an already running server instead.
+"""
+import argparse
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+from http.cookiejar import CookieJar
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FAKE_GEMINI = os.path.join(ROOT, 'bench', 'fake_gemini.py')
+
+QUESTIONS = {
+    'en': ["Will I find love this year?", "How will my career go?", "What should I focus on right now?"],
+    'zh_Hans': ["我的事业怎么样？", "我今年会遇到爱情吗？", "我现在应该专注什么？"],
+}
+FOLLOWUPS = {
+    'en': ["Can you tell me more about the future card?", "What does the past card mean for me?"],
+    'zh_Hans': ["未来那张牌还能多说一点吗？", "过去那张牌对我意味着什么？"],
+}
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def wait_for_port(port, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=1):
+                return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f"Nothing listening on port {port} after {timeout}s")
+
+
+def percentile(samples, fraction):
+    if not samples:
+        return float('nan')
+    ordered = sorted(samples)
+    return ordered[min(int(fraction * len(ordered)), len(ordered) - 1)]
+
+
+# --- Process sampling ---
+
+def read_proc_status(pid):
+    status = {}
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                name, _, value = line.partition(':')
+                status[name] = value.strip()
+    except FileNotFoundError:
+        return None
+    return {'threads': int(status['Threads']), 'rss_mb': int(status['VmRSS'].split()[0]) / 1024}
+
+
+def worker_pids(master_pid):
+    try:
+        with open(f"/proc/{master_pid}/task/{master_pid}/children") as f:
+            return [int(pid) for pid in f.read().split()]
+    except FileNotFoundError:
+        return []
+
+
+class WorkerSampler(threading.Thread):
+    """Records peak threads and RSS of each gunicorn worker while the test runs."""
+
+    def __init__(self, master_pid, interval=0.5):
+        super().__init__(daemon=True)
+        self.master_pid = master_pid
+        self.interval = interval
+        self.peaks = {}
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            for pid in worker_pids(self.master_pid):
+                sample = read_proc_status(pid)
+                if sample is None:
+                    continue
+                peak = self.peaks.setdefault(pid, {'threads': 0, 'rss_mb': 0.0})
+                peak['threads'] = max(peak['threads'], sample['threads'])
+                peak['rss_mb'] = max(peak['rss_mb'], sample['rss_mb'])
+
+
+# --- Load generation ---
+
+class Session:
+    """One browser-like client with its own cookie jar."""
+
+    def __init__(self, base_url, locale, timeout):
+        self.base_url = base_url
+        self.locale = locale
+        self.timeout = timeout
+        self.opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(CookieJar()))
+
+    def start(self):
+        self.opener.open(f"{self.base_url}/set_language/{self.locale}", timeout=self.timeout).read()
+
+    def chat(self, question, mode, stream=False):
+        """Returns (latency, time to first token or None, ok)."""
+        body = json.dumps({'question': question, 'mode': mode}).encode()
+        path = '/chat/stream' if stream else '/chat'
+        request = urllib.request.Request(f"{self.base_url}{path}", data=body, headers={'Content-Type': 'application/json'})
+        start = time.monotonic()
+        first_token = None
+        try:
+            with self.opener.open(request, timeout=self.timeout) as response:
+                if not stream:
+                    response.read()
+                    ok = response.status == 200
+                else:
+                    ok = False
+                    for line in response:
+                        if line.startswith(b'event: token') and first_token is None:
+                            first_token = time.monotonic() - start
+                        elif line.startswith(b'event: error'):
+                            break
+                        elif line.startswith(b'event: done'):
+                            ok = True
+        except (urllib.error.URLError, OSError):
+            ok = False
+        return time.monotonic() - start, first_token, ok
+
+
+def run_load(base_url, sessions, duration, followups, timeout, stream=False):
+    results = {'tarot': [], 'chat': []}
+    first_tokens = {'tarot': [], 'chat': []}
+    errors = {'tarot': 0, 'chat': 0}
+    lock = threading.Lock()
+    deadline = time.monotonic() + duration
+
+    def client(index):
+        locale = 'zh_Hans' if index % 2 else 'en'
+        session = Session(base_url, locale, timeout)
+        session.start()
+        turn = 0
+        while time.monotonic() < deadline:
+            plan = [('tarot', QUESTIONS[locale][turn % len(QUESTIONS[locale])])]
+            plan += [('chat', FOLLOWUPS[locale][i % len(FOLLOWUPS[locale])]) for i in range(followups)]
+            for mode, question in plan:
+                latency, first_token, ok = session.chat(question, mode, stream)
+                with lock:
+                    if ok:
+                        results[mode].append(latency)
+                        if first_token is not None:
+                            first_tokens[mode].append(first_token)
+                    else:
+                        errors[mode] += 1
+            turn += 1
+
+    started = time.monotonic()
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(sessions)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.monotonic() - started
+
+    report = {}
+    for mode, samples in results.items():
+        report[mode] = {
+            'requests': len(samples),
+            'errors': errors[mode],
+            'rps': len(samples) / elapsed,
+            'p50': percentile(samples, 0.50),
+            'p95': percentile(samples, 0.95),
+            'p99': percentile(samples, 0.99),
+            'mean': statistics.fmean(samples) if samples else float('nan'),
+        }
+        if stream:
+            report[mode]['ttft_p50'] = percentile(first_tokens[mode], 0.50)
+            report[mode]['ttft_p95'] = percentile(first_tokens[mode], 0.95)
+    return report
+
+
+# --- Server management ---
+
+def start_gunicorn(config, gemini_port, keys):
+    worker_class, _, rest = config.partition(':')
+    workers, _, threads = rest.partition(':')
+    port = free_port()
+    env = dict(os.environ)
+    env.update({
+        'PORT': str(port),
+        'GUNICORN_WORKER_CLASS': worker_class,
+        'WEB_CONCURRENCY': workers or '1',
+        'GUNICORN_THREADS': threads or '1',
+        'GEMINI_API_ENDPOINT': f"127.0.0.1:{gemini_port}",
+    })
+    env = {name: value for name, value in env.items() if not name.startswith('GEMINI_API_KEY_')}
+    for i in range(keys):
+        env[f"GEMINI_API_KEY_{i + 1}"] = f"fake-key-{i + 1:04d}"
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', 'app.main:app'],
+        cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    wait_for_port(port)
+    return process, port
+
+
+def stop(process):
+    process.terminate()
+    try:
+        process.wait(timeout=10)
+    except subprocess.TimeoutExpired:
+        process.kill()
+
+
+def print_report(name, report, peaks):
+    print(f"\n== {name} ==")
+    streamed = any('ttft_p50' in stats for stats in report.values())
+    ttft_header = f" {'ttft50':>7} {'ttft95':>7}" if streamed else ''
+    print(f"{'mode':<6} {'reqs':>6} {'errs':>5} {'req/s':>7} {'p50':>7} {'p95':>7} {'p99':>7}{ttft_header}")
+    for mode, stats in report.items():
+        ttft = f" {stats['ttft_p50']:>7.2f} {stats['ttft_p95']:>7.2f}" if streamed else ''
+        print(f"{mode:<6} {stats['requests']:>6} {stats['errors']:>5} {stats['rps']:>7.2f} "
+              f"{stats['p50']:>7.2f} {stats['p95']:>7.2f} {stats['p99']:>7.2f}{ttft}")
+    for pid, peak in sorted(peaks.items()):
+        print(f"worker {pid}: peak {peak['threads']} threads, {peak['rss_mb']:.1f} MB RSS")
+
+
+def parse_args(argv=None):
+    if argv is None:
+        argv = sys.argv[1:]
+    fake_args = []
+    if '--' in argv:
+        split = argv.index('--')
+        argv, fake_args = argv[:split], argv[split + 1:]
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--config', action='append', default=[], help='WORKER_CLASS[:WORKERS[:THREADS]], repeatable')
+    parser.add_argument('--url', help='Load test an already running server instead of starting gunicorn')
+    parser.add_argument('--sessions', type=int, default=20, help='Concurrent client sessions')
+    parser.add_argument('--duration', type=float, default=20, help='Seconds to generate load for')
+    parser.add_argument('--followups', type=int, default=1, help='Chat questions after each tarot reading')
+    parser.add_argument('--keys', type=int, default=2, help='Fake GEMINI_API_KEY_n variables to configure')
+    parser.add_argument('--timeout', type=float, default=60, help='Client timeout per request')
+    parser.add_argument('--stream', action='store_true', help='Use /chat/stream and report time to first token')
+    parser.add_argument('--json', help='Also write the results to this file')
+    args = parser.parse_args(argv)
+    args.fake_args = fake_args
+    if not args.config and not args.url:
+        args.config = ['gthread:1:200']
+    return args
+
+
+def main():
+    args = parse_args()
+    results = {}
+
+    if args.url:
+        report = run_load(args.url.rstrip('/'), args.sessions, args.duration, args.followups, args.timeout, args.stream)
+        print_report(args.url, report, {})
+        results[args.url] = {'report': report}
+    else:
+        gemini_port = free_port()
+        fake = subprocess.Popen([sys.executable, FAKE_GEMINI, '--port', str(gemini_port), *args.fake_args])
+        try:
+            wait_for_port(gemini_port)
+            for config in args.config:
+                server, port = start_gunicorn(config, gemini_port, args.keys)
+                sampler = WorkerSampler(server.pid)
+                sampler.start()
+                try:
+                    report = run_load(f"http://127.0.0.1:{port}", args.sessions, args.duration, args.followups, args.timeout, args.stream)
+                finally:
+                    sampler.stopped.set()
+                    stop(server)
+                print_report(config, report, sampler.peaks)
+                results[config] = {'report': report, 'workers': sampler.peaks}
+        finally:
+            stop(fake)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
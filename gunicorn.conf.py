@@ -0,0 +1,14 @@
+import os
+
+# Readings spend almost all of their time waiting on Gemini. The calls run on
+# an asyncio loop inside each worker (see app/key_scheduler.py), so a request
+# thread just parks on a future while it waits. gthread workers let one
+# process hold hundreds of those parked requests at once.
+bind = f"0.0.0.0:{os.getenv('PORT', '8000')}"
+worker_class = os.getenv('GUNICORN_WORKER_CLASS', 'gthread')
+workers = int(os.getenv('WEB_CONCURRENCY', '1'))
+threads = int(os.getenv('GUNICORN_THREADS', '200'))
+
+# Streamed readings keep the connection open until Gemini finishes writing.
+timeout = int(os.getenv('GUNICORN_TIMEOUT', '90'))
+keepalive = 5
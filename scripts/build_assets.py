@@ -0,0 +1,163 @@
+"""Builds content-hashed, optimized static assets into static/dist/.
+
+    python scripts/build_assets.py
+
+For every image in static/images/ this writes a hashed copy of the original
+plus resized WebP and AVIF variants for `srcset`. style.css, main.js and
+typing.js get hashed copies with .gz and .br siblings for precompressed
+serving. static/dist/manifest.json maps each source file to its outputs and
+is what app/assets.py reads at runtime.
+
+Pillow is needed for the image variants and the `brotli` package for .br
+files; without them those outputs are skipped with a warning.
+"""
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import posixpath
+import re
+import shutil
+from io import BytesIO
+import sys
+
+try:
+    from PIL import Image, features
+except ImportError:
+    Image = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+STATIC_DIR = os.path.join(ROOT, 'static')
+DIST_DIR = os.path.join(STATIC_DIR, 'dist')
+MANIFEST_PATH = os.path.join(DIST_DIR, 'manifest.json')
+
+# Cards are shown at most 120px wide (see .card-container), so these cover 1x-3x screens
+IMAGE_WIDTHS = (120, 240, 360)
+IMAGE_FORMATS = (('image/avif', 'AVIF', '.avif', {'quality': 55}),
+                 ('image/webp', 'WEBP', '.webp', {'quality': 78, 'method': 6}))
+TEXT_ASSETS = ('css/style.css', 'js/main.js', 'js/typing.js')
+CSS_URL_PATTERN = re.compile(r"url\(['\"]?\.\./(images/[^'\")]+)['\"]?\)")
+CSS_BACKGROUND_PATTERN = re.compile(r"background-image:\s*url\(['\"]?\.\./(images/[^'\")]+)['\"]?\)\s*;")
+
+
+def content_hash(data):
+    return hashlib.sha256(data).hexdigest()[:12]
+
+
+def write_hashed(relative_path, data):
+    """Writes `data` under dist/ with its hash in the name; returns the dist path."""
+    stem, ext = os.path.splitext(relative_path)
+    dist_path = f"dist/{stem}.{content_hash(data)}{ext}"
+    output = os.path.join(STATIC_DIR, dist_path)
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, 'wb') as f:
+        f.write(data)
+    return dist_path
+
+
+def encode_image(image, pil_format, options):
+    buffer = BytesIO()
+    image.save(buffer, pil_format, **options)
+    return buffer.getvalue()
+
+
+def build_image(relative_path):
+    with open(os.path.join(STATIC_DIR, relative_path), 'rb') as f:
+        original = f.read()
+    entry = {'file': write_hashed(relative_path, original), 'variants': {}}
+    if Image is None:
+        return entry
+
+    stem, _ = os.path.splitext(relative_path)
+    with Image.open(os.path.join(STATIC_DIR, relative_path)) as source:
+        source.load()
+        for mime_type, pil_format, ext, options in IMAGE_FORMATS:
+            if not features.check(pil_format.lower()):
+                continue
+            variants = []
+            # Never upscale; small sources get one variant at their own width
+            for width in sorted({min(width, source.width) for width in IMAGE_WIDTHS}):
+                height = round(source.height * width / source.width)
+                resized = source.resize((width, height), Image.LANCZOS)
+                data = encode_image(resized, pil_format, options)
+                variants.append([write_hashed(f"{stem}-{width}{ext}", data), width])
+            entry['variants'][mime_type] = variants
+    return entry
+
+
+def build_text_asset(relative_path, manifest):
+    with open(os.path.join(STATIC_DIR, relative_path), 'rb') as f:
+        data = f.read()
+
+    if relative_path.endswith('.css'):
+        # Point image URLs at the hashed copies, relative to the stylesheet so
+        # they work wherever the app is mounted
+        css_dir = posixpath.dirname(f"dist/{relative_path}")
+
+        def relative_url(path):
+            return f"url('{posixpath.relpath(path, css_dir)}')"
+
+        def rewrite_background(match):
+            image = manifest.get(match.group(1))
+            if image is None:
+                return match.group(0)
+            fallback = relative_url(image['file'])
+            declaration = f"background-image: {fallback};"
+            webp = image['variants'].get('image/webp')
+            if webp:
+                # Browsers without image-set() type() support ignore this and keep the original
+                mime_type = mimetypes.guess_type(image['file'])[0]
+                declaration += (f" background-image: image-set({relative_url(webp[-1][0])} type('image/webp'),"
+                                f" {fallback} type('{mime_type}'));")
+            return declaration
+
+        def rewrite(match):
+            image = manifest.get(match.group(1))
+            return relative_url(image['file']) if image else match.group(0)
+
+        css = CSS_BACKGROUND_PATTERN.sub(rewrite_background, data.decode('utf-8'))
+        data = CSS_URL_PATTERN.sub(rewrite, css).encode('utf-8')
+
+    dist_path = write_hashed(relative_path, data)
+    output = os.path.join(STATIC_DIR, dist_path)
+    with open(output + '.gz', 'wb') as f:
+        f.write(gzip.compress(data, compresslevel=9, mtime=0))
+    if brotli is not None:
+        with open(output + '.br', 'wb') as f:
+            f.write(brotli.compress(data, quality=11))
+    return {'file': dist_path}
+
+
+def main():
+    if Image is None:
+        print("WARNING: Pillow is not installed, skipping WebP/AVIF image variants.")
+    elif not features.check('avif'):
+        print("WARNING: This Pillow build has no AVIF support, skipping AVIF variants.")
+    if brotli is None:
+        print("WARNING: brotli is not installed, skipping .br files.")
+
+    shutil.rmtree(DIST_DIR, ignore_errors=True)
+    manifest = {}
+
+    for name in sorted(os.listdir(os.path.join(STATIC_DIR, 'images'))):
+        if name.lower().endswith(('.jpg', '.jpeg', '.png')):
+            manifest[f"images/{name}"] = build_image(f"images/{name}")
+    for relative_path in TEXT_ASSETS:
+        manifest[relative_path] = build_text_asset(relative_path, manifest)
+
+    with open(MANIFEST_PATH, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+
+    total = sum(os.path.getsize(os.path.join(dirpath, name))
+                for dirpath, _, names in os.walk(DIST_DIR) for name in names)
+    print(f"Built {len(manifest)} assets into {os.path.relpath(DIST_DIR, ROOT)} ({total / 1024 / 1024:.1f} MB).")
+
+
+if __name__ == '__main__':
+    sys.exit(main())
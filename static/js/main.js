@@ -122,10 +122,8 @@ document.addEventListener('DOMContentLoaded', () => {
         messageElement.classList.add('message', sender);
 
         if (sender === 'tarot') {
-            const mascot = document.createElement('img');
-            mascot.src = '/static/images/wizard-cat.png';
-            mascot.alt = 'TarotMeow Mascot';
-            mascot.className = 'tarot-mascot';
+            const mascot = createPicture(images.mascot, 'TarotMeow Mascot', '40px');
+            mascot.querySelector('img').className = 'tarot-mascot';
             messageElement.appendChild(mascot);
 
             const bubble = document.createElement('div');
@@ -155,10 +153,8 @@ document.addEventListener('DOMContentLoaded', () => {
         typingIndicator.id = 'typing-indicator';
         typingIndicator.classList.add('message', 'tarot');
         
-        const mascot = document.createElement('img');
-        mascot.src = '/static/images/wizard-cat.png';
-        mascot.alt = 'TarotMeow Mascot';
-        mascot.className = 'tarot-mascot';
+        const mascot = createPicture(images.mascot, 'TarotMeow Mascot', '40px');
+        mascot.querySelector('img').className = 'tarot-mascot';
         typingIndicator.appendChild(mascot);
 
         const bubble = document.createElement('div');
@@ -177,7 +173,33 @@ document.addEventListener('DOMContentLoaded', () => {
         }
     }
 
-    function displayCards(cards, container, reading) {
+    function createPicture(image, alt, sizes = '120px') {
+        // <picture> with the AVIF/WebP variants from the asset build, falling back to the original
+        const picture = document.createElement('picture');
+        (image.sources || []).forEach(source => {
+            const sourceElement = document.createElement('source');
+            sourceElement.type = source.type;
+            sourceElement.srcset = source.srcset;
+            sourceElement.sizes = sizes;
+            picture.appendChild(sourceElement);
+        });
+        const img = document.createElement('img');
+        img.src = image.img;
+        img.alt = alt;
+        picture.appendChild(img);
+        return picture;
+    }
+
+    function preloadCards(cards) {
+        // Creating the pictures starts the image downloads, before the cards are on screen
+        const pictures = {};
+        Object.keys(cards).forEach(position => {
+            pictures[position] = createPicture(cards[position], cards[position].name);
+        });
+        return { cards, pictures };
+    }
+
+    function displayCards({ cards, pictures }, container, reading) {
         container.innerHTML = ''; // Clear previous cards
         const displayOrder = ['past', 'present', 'future'];
         let flippedCount = 0;
@@ -190,7 +212,13 @@ document.addEventListener('DOMContentLoaded', () => {
         container.parentNode.insertBefore(revealBtn, container.nextSibling);
 
         revealBtn.addEventListener('click', () => {
-            addTarotMessage(reading, true); // Use typing effect for the main reading
+            if (reading.done) {
+                addTarotMessage(reading.text, true); // Use typing effect for the main reading
+            } else {
+                // Still being generated: show what we have and keep rendering as it arrives
+                const bubble = appendMessage('', 'tarot').querySelector('.tarot-bubble');
+                reading.attach(createStreamRenderer(bubble, scrollToBottom));
+            }
             revealBtn.style.display = 'none'; // Hide button after click
         }, { once: true });
 
@@ -207,21 +235,16 @@ document.addEventListener('DOMContentLoaded', () => {
             // Card Front
             const cardFront = document.createElement('div');
             cardFront.className = 'card-face card-front';
-            const img = document.createElement('img');
-            img.src = cardData.img;
-            img.alt = cardData.name;
+            const picture = pictures[position];
             if (cardData.orientation === 'Reversed') {
-                img.classList.add('reversed');
+                picture.querySelector('img').classList.add('reversed');
             }
-            cardFront.appendChild(img);
+            cardFront.appendChild(picture);
 
             // Card Back
             const cardBack = document.createElement('div');
             cardBack.className = 'card-face card-back';
-            const backImg = document.createElement('img');
-            backImg.src = '/static/images/card_back.jpg';
-            backImg.alt = 'Card Back';
-            cardBack.appendChild(backImg);
+            cardBack.appendChild(createPicture(images.cardBack, 'Card Back'));
 
             const positionLabel = document.createElement('p');
             positionLabel.textContent = translations[position.toLowerCase()] || position.charAt(0).toUpperCase() + position.slice(1);
@@ -253,9 +276,58 @@ document.addEventListener('DOMContentLoaded', () => {
         });
     }
 
+    function createReadingStream() {
+        // Buffers a streamed reading so it can be shown before, during or after it finishes
+        const reading = { text: '', done: false, renderer: null };
+        reading.push = (chunk) => {
+            reading.text += chunk;
+            if (reading.renderer) reading.renderer.append(chunk);
+        };
+        reading.finish = () => {
+            reading.done = true;
+            if (reading.renderer) reading.renderer.finish();
+        };
+        reading.attach = (renderer) => {
+            reading.renderer = renderer;
+            renderer.append(reading.text);
+            if (reading.done) renderer.finish();
+        };
+        return reading;
+    }
+
+    async function readEventStream(response, onEvent) {
+        // Parses the Server-Sent Events sent by /chat/stream
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = '';
+        while (true) {
+            const { value, done } = await reader.read();
+            if (done) break;
+            buffer += decoder.decode(value, { stream: true });
+
+            let boundary;
+            while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+                const rawEvent = buffer.slice(0, boundary);
+                buffer = buffer.slice(boundary + 2);
+
+                let eventName = 'message';
+                let data = '';
+                rawEvent.split('\n').forEach(line => {
+                    if (line.startsWith('event: ')) {
+                        eventName = line.slice(7);
+                    } else if (line.startsWith('data: ')) {
+                        data += line.slice(6);
+                    }
+                });
+                onEvent(eventName, JSON.parse(data));
+            }
+        }
+    }
+
     async function handleChatSubmission(question) {
+        const mode = currentMode;
         // Show typing indicator for chat mode, or thinking message for tarot mode
-        if (currentMode === 'chat') {
+        if (mode === 'chat') {
             showTypingIndicator();
         } else {
             const thinkingMessage = translations.thinkingMessage || "Hold your question in your mind... Breathe... The cards are listening.";
@@ -263,14 +335,42 @@ document.addEventListener('DOMContentLoaded', () => {
             await new Promise(resolve => setTimeout(resolve, 2500)); // Pause for reflection
         }
 
-        const readingPromise = fetch('/chat', {
+        const readingPromise = fetch('/chat/stream', {
             method: 'POST',
             headers: { 'Content-Type': 'application/json' },
-            body: JSON.stringify({ question, mode: currentMode }),
+            body: JSON.stringify({ question, mode }),
+        });
+
+        // Read the stream while the shuffle animation plays, so the cards
+        // arrive (and their images start loading) before they are dealt
+        const reading = createReadingStream();
+        let resolveCards;
+        const cardsPromise = new Promise(resolve => { resolveCards = resolve; });
+        const streamPromise = readingPromise.then(response => {
+            if (!response.ok) {
+                throw new Error(translations.errorMessage || 'An error occurred. Please try again.');
+            }
+
+            if (mode === 'chat') {
+                removeTypingIndicator();
+                const bubble = appendMessage('', 'tarot').querySelector('.tarot-bubble');
+                reading.attach(createStreamRenderer(bubble, scrollToBottom));
+            }
+
+            return readEventStream(response, (eventName, data) => {
+                if (eventName === 'cards') {
+                    resolveCards(preloadCards(data));
+                } else if (eventName === 'token') {
+                    reading.push(data.text);
+                } else if (eventName === 'error') {
+                    reading.push(translations.errorMessage || 'An error occurred. Please try again.');
+                }
+            });
         });
+        streamPromise.catch(() => {}); // Handled below, once the animation is over
 
         let animationMessage;
-        if (currentMode === 'tarot') {
+        if (mode === 'tarot') {
             const animationContainer = document.createElement('div');
             animationContainer.className = 'shuffle-animation-container';
             animationMessage = appendMessage(animationContainer, 'tarot', 'card');
@@ -287,24 +387,21 @@ document.addEventListener('DOMContentLoaded', () => {
         }
 
         try {
-            const response = await readingPromise;
-            if (!response.ok) {
-                throw new Error(translations.errorMessage || 'An error occurred. Please try again.');
-            }
-            const data = await response.json();
-
-            if (currentMode === 'chat') {
-                removeTypingIndicator();
-                addTarotMessage(data.reading, true);
-            } else {
-                // The reading is now passed to displayCards, which handles the reveal
-                const animationContainer = animationMessage.querySelector('.shuffle-animation-container');
-                animationContainer.className = 'card-display-container';
-                displayCards(data.cards, animationContainer, data.reading);
+            if (mode === 'tarot') {
+                const preloaded = await Promise.race([cardsPromise, streamPromise.then(() => null)]);
+                if (preloaded) {
+                    // The reading is passed to displayCards, which handles the reveal
+                    const animationContainer = animationMessage.querySelector('.shuffle-animation-container');
+                    animationContainer.className = 'card-display-container';
+                    displayCards(preloaded, animationContainer, reading);
+                }
             }
+            await streamPromise;
+            reading.finish();
 
         } catch (error) {
-            if (currentMode === 'chat') {
+            reading.finish();
+            if (mode === 'chat') {
                 removeTypingIndicator();
             } else if (animationMessage) {
                 animationMessage.remove();
@@ -49,3 +49,45 @@ function typeMessage(element, message) {
 
     type();
 }
+
+
+function createStreamRenderer(element, onRender) {
+    // Renders a Markdown message that keeps growing as chunks arrive from the server.
+    // Re-rendering is batched to one pass per animation frame.
+    let text = '';
+    let finished = false;
+    let renderPending = false;
+    const cursor = document.createElement('span');
+    cursor.className = 'typing-cursor';
+    element.innerHTML = '';
+    element.appendChild(cursor);
+
+    function render() {
+        renderPending = false;
+        element.innerHTML = marked.parse(text);
+        if (!finished) {
+            element.appendChild(cursor);
+        }
+        if (onRender) {
+            onRender();
+        }
+    }
+
+    function scheduleRender() {
+        if (!renderPending) {
+            renderPending = true;
+            requestAnimationFrame(render);
+        }
+    }
+
+    return {
+        append(chunk) {
+            text += chunk;
+            scheduleRender();
+        },
+        finish() {
+            finished = true;
+            scheduleRender();
+        }
+    };
+}